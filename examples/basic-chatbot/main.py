@@ -5,14 +5,24 @@ A production-ready customer support chatbot with conversation memory
 """
 
 import os
+import re
 import json
+import time
+import uuid
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+import threading
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 import openai
+from redis import asyncio as aioredis
 
 # Configure logging
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
@@ -22,20 +32,37 @@ logger = logging.getLogger(__name__)
 openai.api_key = os.getenv("OPENAI_API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4")
 MAX_CONVERSATION_HISTORY = int(os.getenv("MAX_CONVERSATION_HISTORY", "10"))
+REDIS_URL = os.getenv("REDIS_URL")
+# Redis conversations expire once idle this long
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "86400"))
 ESCALATION_KEYWORDS = [kw.strip() for kw in os.getenv("ESCALATION_KEYWORDS", "human,manager,supervisor,escalate").split(',')]
+# Keywords are case-folded once here; each message is case-folded once and
+# scanned in a single pass for every keyword
+ESCALATION_PATTERN = re.compile("|".join(re.escape(kw.casefold()) for kw in ESCALATION_KEYWORDS))
+ENABLE_SEMANTIC_CACHE = os.getenv("ENABLE_SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+
+# Second-resolution timestamp refreshed by a background task, so responses
+# read a string instead of calling datetime.now().isoformat() each time
+_now_iso = datetime.now().isoformat(timespec="seconds")
+
+async def _tick_timestamp():
+    global _now_iso
+    while True:
+        _now_iso = datetime.now().isoformat(timespec="seconds")
+        await asyncio.sleep(1.0)
 
 # FastAPI app
 app = FastAPI(
     title="Basic Chatbot Agent",
     description="A customer support chatbot agent with conversation memory and escalation handling.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Data models
-class ChatMessage(BaseModel):
-    role: str
-    content: str
-
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
@@ -49,9 +76,239 @@ class ChatResponse(BaseModel):
     model_used: str
     timestamp: str
 
-# In-memory conversation history (replace with Redis/DB in production)
-conversation_history: Dict[str, List[ChatMessage]] = {}
-customer_context: Dict[str, Dict[str, Any]] = {}
+# Conversation storage. Messages are kept as {"role", "content"} dicts, the
+# shape the OpenAI API expects, so prompts need no conversion. Only
+# user/assistant turns are stored; the system prompt is constant and
+# prepended when the conversation is read.
+class InMemoryConversationStore:
+    """Process-local storage, not shared between uvicorn workers"""
+
+    def __init__(self, max_messages: int):
+        self.conversations: Dict[str, Deque[Dict[str, str]]] = {}
+        self.customers: Dict[str, Dict[str, Any]] = {}
+        self.max_messages = max_messages
+        # Running total so /stats does not walk every conversation
+        self.total_messages = 0
+
+    async def recent(self, conv_id: str, limit: int) -> List[Dict[str, str]]:
+        history = self.conversations.get(conv_id)
+        if history is None or limit <= 0:
+            return []
+        return list(islice(history, max(len(history) - limit, 0), None))
+
+    async def append(self, conv_id: str, messages: List[Dict[str, str]]) -> None:
+        history = self.conversations.get(conv_id)
+        if history is None:
+            # The bounded deque drops the oldest messages as new ones arrive
+            history = self.conversations[conv_id] = deque(maxlen=self.max_messages)
+        stored_before = len(history)
+        history.extend(messages)
+        self.total_messages += len(history) - stored_before
+
+    async def delete(self, conv_id: str) -> bool:
+        history = self.conversations.pop(conv_id, None)
+        if history is None:
+            return False
+        self.total_messages -= len(history)
+        return True
+
+    async def stats(self) -> Tuple[int, int]:
+        return len(self.conversations), self.total_messages
+
+    async def set_customer_context(self, customer_id: str, context: Dict[str, Any]) -> None:
+        self.customers[customer_id] = context
+
+    async def close(self) -> None:
+        pass
+
+class RedisConversationStore:
+    """Redis-backed storage shared by all workers, one list per conversation.
+
+    Conversations expire after ``ttl`` seconds without a new turn.
+    ``stats:conversations`` and ``stats:messages`` hold running totals;
+    ``conv:lengths`` records what each conversation contributes to them and
+    ``conv:expiry`` when it was last written, so expired conversations can
+    be subtracted from the totals.
+    """
+
+    LENGTHS_KEY = "conv:lengths"
+    EXPIRY_KEY = "conv:expiry"
+    STATS_KEYS = ["stats:conversations", "stats:messages"]
+
+    # Append, trim, refresh the expiry and adjust the totals atomically. The
+    # previous length comes from conv:lengths rather than the list, so a
+    # conversation that expired but was not yet pruned is not counted twice.
+    APPEND_SCRIPT = """
+    local previous = redis.call('HGET', KEYS[2], ARGV[1])
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 5))
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    local stored = redis.call('LLEN', KEYS[1])
+    redis.call('HSET', KEYS[2], ARGV[1], stored)
+    redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+    if not previous then
+        redis.call('INCR', KEYS[4])
+    end
+    redis.call('INCRBY', KEYS[5], stored - tonumber(previous or 0))
+    """
+
+    # Remove a conversation and its contribution to the totals; returns 1 if
+    # it still existed
+    DELETE_SCRIPT = """
+    local previous = redis.call('HGET', KEYS[2], ARGV[1])
+    local deleted = redis.call('DEL', KEYS[1])
+    if previous then
+        redis.call('HDEL', KEYS[2], ARGV[1])
+        redis.call('ZREM', KEYS[3], ARGV[1])
+        redis.call('DECR', KEYS[4])
+        redis.call('DECRBY', KEYS[5], tonumber(previous))
+    end
+    return deleted
+    """
+
+    # Subtract up to ARGV[2] conversations last written before ARGV[1] whose
+    # lists have expired; returns how many were examined
+    PRUNE_SCRIPT = """
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+    for _, id in ipairs(ids) do
+        if redis.call('EXISTS', 'conv:' .. id) == 0 then
+            local previous = redis.call('HGET', KEYS[2], id)
+            redis.call('HDEL', KEYS[2], id)
+            redis.call('ZREM', KEYS[1], id)
+            if previous then
+                redis.call('DECR', KEYS[3])
+                redis.call('DECRBY', KEYS[4], tonumber(previous))
+            end
+        end
+    end
+    return #ids
+    """
+    PRUNE_BATCH = 500
+
+    def __init__(self, url: str, max_messages: int, ttl: int):
+        self.redis = aioredis.Redis.from_url(url, decode_responses=True)
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.append_script = self.redis.register_script(self.APPEND_SCRIPT)
+        self.delete_script = self.redis.register_script(self.DELETE_SCRIPT)
+        self.prune_script = self.redis.register_script(self.PRUNE_SCRIPT)
+
+    async def recent(self, conv_id: str, limit: int) -> List[Dict[str, str]]:
+        if limit <= 0:
+            return []
+        raw = await self.redis.lrange(f"conv:{conv_id}", -limit, -1)
+        return [json.loads(item) for item in raw]
+
+    async def append(self, conv_id: str, messages: List[Dict[str, str]]) -> None:
+        await self.append_script(
+            keys=[f"conv:{conv_id}", self.LENGTHS_KEY, self.EXPIRY_KEY, *self.STATS_KEYS],
+            args=[conv_id, self.max_messages, self.ttl, time.time(), *[json.dumps(msg) for msg in messages]]
+        )
+
+    async def delete(self, conv_id: str) -> bool:
+        deleted = await self.delete_script(
+            keys=[f"conv:{conv_id}", self.LENGTHS_KEY, self.EXPIRY_KEY, *self.STATS_KEYS],
+            args=[conv_id]
+        )
+        return bool(deleted)
+
+    async def stats(self) -> Tuple[int, int]:
+        # Only conversations idle past the TTL are examined, a bounded batch at a time
+        cutoff = time.time() - self.ttl
+        while await self.prune_script(
+            keys=[self.EXPIRY_KEY, self.LENGTHS_KEY, *self.STATS_KEYS],
+            args=[cutoff, self.PRUNE_BATCH]
+        ) == self.PRUNE_BATCH:
+            pass
+        conversations, messages = await self.redis.mget(*self.STATS_KEYS)
+        return int(conversations or 0), int(messages or 0)
+
+    async def set_customer_context(self, customer_id: str, context: Dict[str, Any]) -> None:
+        await self.redis.set(f"customer:{customer_id}", json.dumps(context), ex=self.ttl)
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+if REDIS_URL:
+    conversation_store = RedisConversationStore(REDIS_URL, MAX_CONVERSATION_HISTORY, CONVERSATION_TTL)
+else:
+    conversation_store = InMemoryConversationStore(MAX_CONVERSATION_HISTORY)
+
+class SemanticCache:
+    """Serve stored responses for prompts similar to ones already answered.
+
+    Requires the optional ``sentence-transformers`` and ``faiss-cpu`` packages.
+    Entries expire after a TTL and the oldest are evicted past ``max_entries``,
+    which also bounds the brute-force search.
+    """
+
+    # Prior turns embedded with the new message, so a context-dependent reply
+    # such as "yes, go ahead" only matches after a similar exchange, never one
+    # from an unrelated conversation
+    CONTEXT_MESSAGES = 2
+
+    def __init__(self, threshold: float = 0.9, ttl_seconds: int = 3600, max_entries: int = 10000):
+        from sentence_transformers import SentenceTransformer
+        import faiss
+
+        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        # Inner product over L2-normalized embeddings is cosine similarity
+        self.index = faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+        # Entries are appended in time order, so the oldest are always at the front
+        self.responses: List[str] = []
+        self.created: List[float] = []
+        self.threshold = threshold
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        # Lookups and adds run in worker threads; faiss indexes aren't safe for concurrent writes
+        self.lock = threading.Lock()
+
+    @classmethod
+    def context_text(cls, messages: List[Dict[str, str]]) -> str:
+        """Text to embed for the last of ``messages``, prefixed by its recent turns"""
+        turns = [msg for msg in messages if msg["role"] != "system"][-(cls.CONTEXT_MESSAGES + 1):]
+        return "\n".join(f"{msg['role']}: {msg['content']}" for msg in turns)
+
+    def embed(self, text: str):
+        """Encode a prompt; CPU-bound, so call it from a worker thread"""
+        return self.model.encode([text], normalize_embeddings=True)
+
+    def _evict(self) -> None:
+        """Drop expired entries and any beyond max_entries; call with the lock held"""
+        import numpy as np
+
+        cutoff = time.time() - self.ttl
+        count = max(len(self.responses) - self.max_entries, 0)
+        while count < len(self.created) and self.created[count] < cutoff:
+            count += 1
+        if count:
+            self.index.remove_ids(np.arange(count, dtype="int64"))
+            del self.responses[:count]
+            del self.created[:count]
+
+    def lookup(self, embedding) -> Optional[str]:
+        """Search for a similar prompt; grows with the cache, so call it from a worker thread"""
+        with self.lock:
+            self._evict()
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(embedding, 1)
+            if scores[0, 0] >= self.threshold:
+                return self.responses[ids[0, 0]]
+            return None
+
+    def add(self, embedding, response: str) -> None:
+        """Store a response; call it from a worker thread"""
+        with self.lock:
+            self.index.add(embedding)
+            self.responses.append(response)
+            self.created.append(time.time())
+            self._evict()
+
+if ENABLE_SEMANTIC_CACHE:
+    semantic_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_MAX_ENTRIES)
+else:
+    semantic_cache = None
 
 # System prompt for the chatbot
 SYSTEM_PROMPT = """You are a helpful customer support agent for a technology company. 
@@ -65,90 +322,168 @@ Guidelines:
 - Acknowledge when escalation to human agents is needed
 - Remember context from previous messages in the conversation
 """
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+def should_escalate(message: str) -> bool:
+    """Check the message for escalation keywords"""
+    return ESCALATION_PATTERN.search(message.casefold()) is not None
+
+ESCALATION_RESPONSE = "I understand you'd like to speak with a human agent. I'm connecting you with our support team now. Please hold on while I transfer your conversation."
+
+async def prepare_conversation(request: ChatRequest) -> Tuple[str, Dict[str, str], List[Dict[str, str]]]:
+    """Resolve the conversation ID and build the prompt history for a new user message"""
+    # Generate conversation ID if not provided
+    conv_id = request.conversation_id or f"conv_{uuid.uuid4().hex}"
+    
+    # Store customer context
+    if request.customer_id and request.context:
+        await conversation_store.set_customer_context(request.customer_id, request.context)
+    
+    # Retrieve recent history, leaving room for the new user message
+    user_message = {"role": "user", "content": request.message}
+    history = [SYSTEM_MESSAGE]
+    history.extend(await conversation_store.recent(conv_id, MAX_CONVERSATION_HISTORY - 1))
+    history.append(user_message)
+    
+    logger.info(f"Processing message for conversation {conv_id}: {request.message}")
+    return conv_id, user_message, history
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
+    return {"status": "ok", "timestamp": _now_iso}
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+@app.post("/chat", responses={200: {"model": ChatResponse}})
+async def chat(request: ChatRequest, http_response: Response):
     """Main chat endpoint"""
     try:
-        # Generate conversation ID if not provided
-        conv_id = request.conversation_id or f"conv_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        # Store customer context
-        if request.customer_id and request.context:
-            customer_context[request.customer_id] = request.context
-        
-        # Retrieve conversation history
-        history = conversation_history.get(conv_id, [])
-        
-        # Add system message if this is a new conversation
-        if not history:
-            history.append(ChatMessage(role="system", content=SYSTEM_PROMPT))
-        
-        # Add user message
-        history.append(ChatMessage(role="user", content=request.message))
-        
-        # Trim history to max length (keep system message)
-        if len(history) > MAX_CONVERSATION_HISTORY + 1:  # +1 for system message
-            history = [history[0]] + history[-(MAX_CONVERSATION_HISTORY):]
-        
-        logger.info(f"Processing message for conversation {conv_id}: {request.message}")
+        conv_id, user_message, history = await prepare_conversation(request)
         
         # Check for escalation keywords
-        escalation_triggered = any(keyword.lower() in request.message.lower() for keyword in ESCALATION_KEYWORDS)
+        escalation_triggered = should_escalate(request.message)
         
         if escalation_triggered:
-            response_content = "I understand you'd like to speak with a human agent. I'm connecting you with our support team now. Please hold on while I transfer your conversation."
+            response_content = ESCALATION_RESPONSE
             logger.info(f"Escalation triggered for conversation {conv_id}")
         else:
-            # Generate AI response
-            messages = [{"role": msg.role, "content": msg.content} for msg in history]
+            embedding = None
+            cached_content = None
+            if semantic_cache is not None:
+                embedding = await run_in_threadpool(semantic_cache.embed, semantic_cache.context_text(history))
+                cached_content = await run_in_threadpool(semantic_cache.lookup, embedding)
+                http_response.headers["X-Cache"] = "HIT" if cached_content is not None else "MISS"
             
-            response = openai.chat.completions.create(
-                model=MODEL_NAME,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
-            )
-            
-            response_content = response.choices[0].message.content
-            logger.info(f"AI response generated for conversation {conv_id}")
+            if cached_content is not None:
+                response_content = cached_content
+                logger.info(f"Semantic cache hit for conversation {conv_id}")
+            else:
+                # Generate AI response; the sync client blocks, so run it in a worker thread
+                response = await run_in_threadpool(
+                    openai.chat.completions.create,
+                    model=MODEL_NAME,
+                    messages=history,
+                    temperature=0.7,
+                    max_tokens=500
+                )
+                
+                response_content = response.choices[0].message.content
+                logger.info(f"AI response generated for conversation {conv_id}")
+                
+                if semantic_cache is not None:
+                    await run_in_threadpool(semantic_cache.add, embedding, response_content)
         
-        # Add assistant response to history
-        history.append(ChatMessage(role="assistant", content=response_content))
-        conversation_history[conv_id] = history
+        # Persist the new turn
+        await conversation_store.append(
+            conv_id,
+            [user_message, {"role": "assistant", "content": response_content}]
+        )
         
         return ChatResponse(
             response=response_content,
             conversation_id=conv_id,
             escalation_triggered=escalation_triggered,
             model_used=MODEL_NAME,
-            timestamp=datetime.now().isoformat()
+            timestamp=_now_iso
         )
         
     except Exception as e:
         logger.error(f"Error processing chat request: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream the assistant response as server-sent events"""
+    try:
+        conv_id, user_message, history = await prepare_conversation(request)
+        
+        cached_content = None
+        embedding = None
+        stream = None
+        if should_escalate(request.message):
+            cached_content = ESCALATION_RESPONSE
+            logger.info(f"Escalation triggered for conversation {conv_id}")
+        elif semantic_cache is not None:
+            embedding = await run_in_threadpool(semantic_cache.embed, semantic_cache.context_text(history))
+            cached_content = await run_in_threadpool(semantic_cache.lookup, embedding)
+        
+        if cached_content is None:
+            stream = await run_in_threadpool(
+                openai.chat.completions.create,
+                model=MODEL_NAME,
+                messages=history,
+                temperature=0.7,
+                max_tokens=500,
+                stream=True
+            )
+    except Exception as e:
+        logger.error(f"Error processing chat stream request: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    
+    async def events():
+        if stream is None:
+            response_content = cached_content
+            yield f"data: {json.dumps({'content': response_content})}\n\n"
+        else:
+            parts = []
+            async for chunk in iterate_in_threadpool(stream):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield f"data: {json.dumps({'content': delta})}\n\n"
+            response_content = "".join(parts)
+            logger.info(f"AI response streamed for conversation {conv_id}")
+            if semantic_cache is not None:
+                await run_in_threadpool(semantic_cache.add, embedding, response_content)
+        
+        # Persist the turn once the full response is known
+        await conversation_store.append(
+            conv_id,
+            [user_message, {"role": "assistant", "content": response_content}]
+        )
+        yield "data: [DONE]\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"X-Conversation-ID": conv_id}
+    )
+
 @app.get("/conversations/{conversation_id}")
 async def get_conversation(conversation_id: str):
     """Get conversation history"""
-    history = conversation_history.get(conversation_id, [])
+    history = await conversation_store.recent(conversation_id, MAX_CONVERSATION_HISTORY)
+    if history:
+        history.insert(0, SYSTEM_MESSAGE)
     return {
         "conversation_id": conversation_id,
-        "messages": [{"role": msg.role, "content": msg.content} for msg in history],
+        "messages": history,
         "message_count": len(history)
     }
 
 @app.delete("/conversations/{conversation_id}")
 async def clear_conversation(conversation_id: str):
     """Clear conversation history"""
-    if conversation_id in conversation_history:
-        del conversation_history[conversation_id]
+    if await conversation_store.delete(conversation_id):
         logger.info(f"Cleared conversation {conversation_id}")
         return {"message": f"Conversation {conversation_id} cleared"}
     else:
@@ -157,19 +492,41 @@ async def clear_conversation(conversation_id: str):
 @app.get("/stats")
 async def get_stats():
     """Get chatbot statistics"""
-    total_conversations = len(conversation_history)
-    total_messages = sum(len(history) for history in conversation_history.values())
+    total_conversations, total_messages = await conversation_store.stats()
+    # Count the system prompt each conversation starts with
+    total_messages += total_conversations
     
     return {
         "total_conversations": total_conversations,
         "total_messages": total_messages,
         "active_conversations": total_conversations,
         "model_used": MODEL_NAME,
-        "uptime": datetime.now().isoformat()
+        "uptime": _now_iso
     }
 
+@app.on_event("startup")
+async def startup_event():
+    """Start the timestamp clock"""
+    app.state.clock = asyncio.create_task(_tick_timestamp())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the clock and release the conversation store connection"""
+    app.state.clock.cancel()
+    await conversation_store.close()
+
 if __name__ == "__main__":
     import uvicorn
     
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    
     logger.info(f"Starting Basic Chatbot Agent with model: {MODEL_NAME}")
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    # Multiple workers only share conversations when REDIS_URL is set
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8080,
+        loop="uvloop",
+        http="httptools",
+        workers=workers
+    )
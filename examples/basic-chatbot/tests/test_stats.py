@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for the running /stats totals kept by the conversation stores
+
+The OpenAI client is replaced by a stub, and each test gets a fresh store so
+the totals start from zero.
+"""
+
+import importlib.util
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+# main.py is not an importable package module, so load it by path
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+_spec = importlib.util.spec_from_file_location(
+    "basic_chatbot_main", Path(__file__).resolve().parents[1] / "main.py"
+)
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+MAX_MESSAGES = 10
+
+def create_completion(**params):
+    """Stands in for ``openai.chat.completions.create``"""
+    reply = SimpleNamespace(content=f"Echo: {params['messages'][-1]['content']}")
+    return SimpleNamespace(choices=[SimpleNamespace(message=reply)])
+
+def in_memory_store():
+    return main.InMemoryConversationStore(MAX_MESSAGES)
+
+def redis_store(ttl: int = 3600):
+    fakeredis = pytest.importorskip("fakeredis")
+    store = main.RedisConversationStore("redis://localhost:6379", MAX_MESSAGES, ttl)
+    store.redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    for name in ("append_script", "delete_script", "prune_script"):
+        setattr(store, name, store.redis.register_script(getattr(store, name).script))
+    return store
+
+def make_client(monkeypatch, store):
+    monkeypatch.setattr(main, "conversation_store", store)
+    monkeypatch.setattr(main, "semantic_cache", None)
+    monkeypatch.setattr(
+        main, "openai",
+        SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create_completion)))
+    )
+    return TestClient(main.app)
+
+@pytest.fixture(params=[in_memory_store, redis_store], ids=["memory", "redis"])
+def client(request, monkeypatch):
+    """Test client backed by a fresh conversation store"""
+    with make_client(monkeypatch, request.param()) as test_client:
+        yield test_client
+
+def chat(client, conversation_id: str, turns: int):
+    for turn in range(turns):
+        response = client.post("/chat", json={"message": f"Question {turn}", "conversation_id": conversation_id})
+        assert response.status_code == 200
+
+def totals(client):
+    stats = client.get("/stats").json()
+    return stats["total_conversations"], stats["total_messages"]
+
+class TestStats:
+    """Test conversation and message totals across writes, evictions and deletes"""
+
+    def test_empty_store(self, client):
+        assert totals(client) == (0, 0)
+
+    def test_totals_count_stored_messages_and_system_prompts(self, client):
+        chat(client, "conv_a", 2)
+        chat(client, "conv_b", 1)
+
+        # 4 + 2 stored messages, plus one system prompt per conversation
+        assert totals(client) == (2, 8)
+
+    def test_evicted_messages_are_not_counted(self, client):
+        # 7 turns store 14 messages, but only the newest 10 are kept
+        chat(client, "conv_a", 7)
+        chat(client, "conv_b", 1)
+
+        assert totals(client) == (2, 14)
+        assert client.get("/conversations/conv_a").json()["message_count"] == MAX_MESSAGES + 1
+
+    def test_delete_removes_conversation_from_totals(self, client):
+        chat(client, "conv_a", 7)
+        chat(client, "conv_b", 1)
+
+        assert client.delete("/conversations/conv_a").status_code == 200
+
+        assert totals(client) == (1, 3)
+
+    def test_deleting_unknown_conversation_leaves_totals_unchanged(self, client):
+        chat(client, "conv_a", 1)
+
+        assert client.delete("/conversations/missing").status_code == 404
+        assert client.delete("/conversations/conv_a").status_code == 200
+        assert client.delete("/conversations/conv_a").status_code == 404
+
+        assert totals(client) == (0, 0)
+
+    def test_conversation_can_be_restarted_after_delete(self, client):
+        chat(client, "conv_a", 7)
+        client.delete("/conversations/conv_a")
+        chat(client, "conv_a", 1)
+
+        assert totals(client) == (1, 3)
+
+class TestRedisExpiry:
+    """Test that expired Redis conversations leave the totals"""
+
+    def test_expired_conversations_are_subtracted(self, monkeypatch):
+        with make_client(monkeypatch, redis_store(ttl=1)) as client:
+            chat(client, "conv_a", 7)
+            chat(client, "conv_b", 1)
+            assert totals(client) == (2, 14)
+
+            time.sleep(1.1)
+
+            assert totals(client) == (0, 0)
+            assert client.get("/conversations/conv_a").json()["message_count"] == 0
+            assert client.delete("/conversations/conv_a").status_code == 404
+
+    def test_conversation_restarted_after_expiry_is_counted_once(self, monkeypatch):
+        with make_client(monkeypatch, redis_store(ttl=1)) as client:
+            chat(client, "conv_a", 7)
+
+            time.sleep(1.1)
+            chat(client, "conv_a", 1)
+
+            assert totals(client) == (1, 3)
@@ -4,27 +4,65 @@ Chatbot Agent - Customer Support Agent with Conversation Memory
 """
 
 import os
+import time
+import re
+import json
+import uuid
 import asyncio
 import logging
+import threading
 from datetime import datetime
-from typing import Dict, List, Optional
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Set, Tuple
 from dataclasses import dataclass, asdict
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+import httpx
 import openai
+import uvicorn
+from redis import asyncio as aioredis
+
+# Set at import so every worker process reports its own uptime; monotonic
+# time is unaffected by wall-clock adjustments
+start_time = time.monotonic()
 
 # Configure logging
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
+# Second-resolution timestamp refreshed by a background task, so responses
+# read a string instead of calling datetime.now().isoformat() each time
+_now_iso = datetime.now().isoformat(timespec="seconds")
+
+async def _tick_timestamp():
+    global _now_iso
+    while True:
+        _now_iso = datetime.now().isoformat(timespec="seconds")
+        await asyncio.sleep(1.0)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Chatbot Agent",
     description="AI-powered customer support chatbot with conversation memory",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
+
+# Shared HTTP connection pool for all OpenAI calls, sized for many
+# concurrent sessions and multiplexed over HTTP/2
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_keepalive_connections=200, max_connections=500, keepalive_expiry=30),
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=5.0)
 )
 
+# Kept as a single constant so the system message is identical on every call
+SYSTEM_PROMPT = "You are a helpful customer support assistant. Be friendly, professional, and helpful."
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
 # Request/Response models
 class ChatRequest(BaseModel):
     message: str
@@ -43,119 +81,490 @@ class HealthResponse(BaseModel):
 
 @dataclass
 class ConversationHistory:
-    messages: List[Dict[str, str]]
+    # The first turns are frozen so the prompt prefix stays byte-identical
+    # across calls and can be served from the provider's prompt cache
+    prefix: List[Dict[str, str]]
+    # Rolling tail as (sequence number, message), so compaction can tell
+    # exactly which messages a summary covers
+    messages: Deque[Tuple[int, Dict[str, str]]]
     created_at: datetime
     updated_at: datetime
+    # Rolling summary of tail messages that have been compacted away
+    summary: Optional[str] = None
+    next_seq: int = 0
+
+def summary_message(summary: Optional[str]) -> List[Dict[str, str]]:
+    if not summary:
+        return []
+    return [{"role": "system", "content": f"Prior context: {summary}"}]
+
+class InMemoryConversationStore:
+    """Process-local session storage, not shared between uvicorn workers"""
+
+    def __init__(self, prefix_messages: int, max_messages: int):
+        self.sessions: Dict[str, ConversationHistory] = {}
+        self.prefix_messages = prefix_messages
+        self.max_messages = max_messages
+
+    async def history(self, session_id: str, tail_messages: int) -> List[Dict[str, str]]:
+        """Return the prefix, the summary and the last ``tail_messages`` tail messages"""
+        history = self.sessions.get(session_id)
+        if history is None:
+            return []
+        start = max(0, len(history.messages) - tail_messages)
+        return (
+            history.prefix
+            + summary_message(history.summary)
+            + [msg for _, msg in islice(history.messages, start, None)]
+        )
+
+    async def append(self, session_id: str, messages: List[Dict[str, str]]) -> int:
+        """Append messages and return the length of the rolling tail"""
+        now = datetime.now()
+        history = self.sessions.get(session_id)
+        if history is None:
+            history = self.sessions[session_id] = ConversationHistory(
+                prefix=[],
+                # The bounded deque drops the oldest messages as new ones arrive
+                messages=deque(maxlen=self.max_messages),
+                created_at=now,
+                updated_at=now
+            )
+        free = self.prefix_messages - len(history.prefix)
+        if free > 0:
+            history.prefix.extend(messages[:free])
+            messages = messages[free:]
+        for msg in messages:
+            history.messages.append((history.next_seq, msg))
+            history.next_seq += 1
+        history.updated_at = now
+        return len(history.messages)
+
+    async def oldest(self, session_id: str, count: int) -> Tuple[Optional[str], List[Dict[str, str]], int]:
+        """Return the current summary, the oldest ``count`` tail messages and the last one's sequence number"""
+        history = self.sessions[session_id]
+        oldest = list(islice(history.messages, count))
+        return history.summary, [msg for _, msg in oldest], oldest[-1][0] if oldest else -1
+
+    async def compact(self, session_id: str, through_seq: int, summary: str) -> None:
+        """Replace tail messages up to ``through_seq`` with ``summary``.
+
+        Goes by sequence number rather than count: the bounded deque may
+        have evicted some of them while the summary was being generated.
+        """
+        history = self.sessions[session_id]
+        while history.messages and history.messages[0][0] <= through_seq:
+            history.messages.popleft()
+        history.summary = summary
+
+    async def close(self) -> None:
+        pass
+
+class RedisConversationStore:
+    """Redis-backed session storage shared by all workers.
+
+    Each session is two lists: ``session:<id>:prefix`` holds the frozen
+    opening turns and ``session:<id>`` the rolling tail, whose entries are
+    ``{"seq": n, "message": {...}}`` numbered from ``session:<id>:seq``.
+    The rolling summary is kept in ``session:<id>:summary``. All four keys
+    expire after ``ttl`` seconds without a new turn.
+    """
+
+    # Drop tail entries from the left up to a sequence number and store the
+    # summary, atomically, so entries LTRIM already evicted aren't counted twice
+    COMPACT_SCRIPT = """
+    local items = redis.call('LRANGE', KEYS[1], 0, -1)
+    local drop = 0
+    for _, item in ipairs(items) do
+        if cjson.decode(item)['seq'] > tonumber(ARGV[1]) then
+            break
+        end
+        drop = drop + 1
+    end
+    if drop > 0 then
+        redis.call('LTRIM', KEYS[1], drop, -1)
+    end
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+    """
+
+    def __init__(self, url: str, prefix_messages: int, max_messages: int, ttl: int):
+        self.redis = aioredis.Redis.from_url(url, decode_responses=True)
+        self.prefix_messages = prefix_messages
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.compact_script = self.redis.register_script(self.COMPACT_SCRIPT)
+
+    async def history(self, session_id: str, tail_messages: int) -> List[Dict[str, str]]:
+        """Return the prefix, the summary and the last ``tail_messages`` tail messages"""
+        key = f"session:{session_id}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.lrange(f"{key}:prefix", 0, -1)
+            pipe.get(f"{key}:summary")
+            pipe.lrange(key, -tail_messages, -1)
+            prefix, summary, tail = await pipe.execute()
+        return (
+            [json.loads(item) for item in prefix]
+            + summary_message(summary)
+            + [json.loads(item)["message"] for item in tail]
+        )
+
+    async def append(self, session_id: str, messages: List[Dict[str, str]]) -> int:
+        """Append messages and return the length of the rolling tail"""
+        key = f"session:{session_id}"
+        free = self.prefix_messages - await self.redis.llen(f"{key}:prefix")
+        prefix, messages = (messages[:free], messages[free:]) if free > 0 else ([], messages)
+        if messages:
+            last_seq = await self.redis.incrby(f"{key}:seq", len(messages))
+            first_seq = last_seq - len(messages) + 1
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if prefix:
+                pipe.rpush(f"{key}:prefix", *[json.dumps(msg) for msg in prefix])
+            if messages:
+                pipe.rpush(key, *[
+                    json.dumps({"seq": seq, "message": msg})
+                    for seq, msg in enumerate(messages, start=first_seq)
+                ])
+                pipe.ltrim(key, -self.max_messages, -1)
+            # Every turn refreshes the session's expiry
+            for suffix in ("", ":prefix", ":seq", ":summary"):
+                pipe.expire(key + suffix, self.ttl)
+            pipe.llen(key)
+            results = await pipe.execute()
+        return results[-1]
+
+    async def oldest(self, session_id: str, count: int) -> Tuple[Optional[str], List[Dict[str, str]], int]:
+        """Return the current summary, the oldest ``count`` tail messages and the last one's sequence number"""
+        key = f"session:{session_id}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(f"{key}:summary")
+            pipe.lrange(key, 0, count - 1)
+            summary, raw = await pipe.execute()
+        entries = [json.loads(item) for item in raw]
+        return summary, [entry["message"] for entry in entries], entries[-1]["seq"] if entries else -1
+
+    async def compact(self, session_id: str, through_seq: int, summary: str) -> None:
+        """Replace tail messages up to ``through_seq`` with ``summary``"""
+        key = f"session:{session_id}"
+        await self.compact_script(keys=[key, f"{key}:summary"], args=[through_seq, summary, self.ttl])
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+class SemanticCache:
+    """Serve stored responses for prompts similar to ones already answered.
+
+    Requires the optional ``sentence-transformers`` and ``faiss-cpu`` packages.
+    Entries expire after a TTL and the oldest are evicted past ``max_entries``,
+    which also bounds the brute-force search.
+    """
+
+    # Prior turns embedded with the new message, so a context-dependent reply
+    # such as "yes, go ahead" only matches after a similar exchange, never one
+    # from an unrelated conversation
+    CONTEXT_MESSAGES = 2
+
+    def __init__(self, threshold: float = 0.9, ttl_seconds: int = 3600, max_entries: int = 10000):
+        from sentence_transformers import SentenceTransformer
+        import faiss
+
+        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        # Inner product over L2-normalized embeddings is cosine similarity
+        self.index = faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+        # Entries are appended in time order, so the oldest are always at the front
+        self.responses: List[str] = []
+        self.created: List[float] = []
+        self.threshold = threshold
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        # Lookups and adds run in worker threads; faiss indexes aren't safe for concurrent writes
+        self.lock = threading.Lock()
+
+    @classmethod
+    def context_text(cls, messages: List[Dict[str, str]]) -> str:
+        """Text to embed for the last of ``messages``, prefixed by its recent turns"""
+        turns = [msg for msg in messages if msg["role"] != "system"][-(cls.CONTEXT_MESSAGES + 1):]
+        return "\n".join(f"{msg['role']}: {msg['content']}" for msg in turns)
+
+    def embed(self, text: str):
+        return self.model.encode([text], normalize_embeddings=True)
+
+    def _evict(self) -> None:
+        """Drop expired entries and any beyond max_entries; call with the lock held"""
+        import numpy as np
+
+        cutoff = time.time() - self.ttl
+        count = max(len(self.responses) - self.max_entries, 0)
+        while count < len(self.created) and self.created[count] < cutoff:
+            count += 1
+        if count:
+            self.index.remove_ids(np.arange(count, dtype="int64"))
+            del self.responses[:count]
+            del self.created[:count]
+
+    def lookup(self, embedding) -> Optional[str]:
+        """Search for a similar prompt; grows with the cache, so call it from a worker thread"""
+        with self.lock:
+            self._evict()
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(embedding, 1)
+            if scores[0, 0] >= self.threshold:
+                return self.responses[ids[0, 0]]
+            return None
+
+    def add(self, embedding, response: str) -> None:
+        """Store a response; call it from a worker thread"""
+        with self.lock:
+            self.index.add(embedding)
+            self.responses.append(response)
+            self.created.append(time.time())
+            self._evict()
+
+class CompletionBatcher:
+    """Coalesce concurrent chat completions into batches dispatched together.
+
+    A request made while no other completion is in flight is sent straight
+    away. Under load, requests queue for up to ``max_wait`` seconds so that
+    up to ``max_batch`` of them are submitted in one ``asyncio.gather``.
+    """
+
+    def __init__(self, client: openai.AsyncOpenAI, max_batch: int = 16, max_wait: float = 0.01):
+        self.client = client
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.in_flight = 0
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def create(self, **params):
+        self.in_flight += 1
+        try:
+            if self._worker is None or self.in_flight == 1:
+                return await self.client.chat.completions.create(**params)
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((params, future))
+            return await future
+        finally:
+            self.in_flight -= 1
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next batch can start collecting
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        results = await asyncio.gather(
+            *(self.client.chat.completions.create(**params) for params, _ in batch),
+            return_exceptions=True
+        )
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
 
 class ChatbotAgent:
-    def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
+    def __init__(self, http_client: httpx.AsyncClient):
+        self.client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=http_client
+        )
+        self.batcher = CompletionBatcher(
+            self.client,
+            max_batch=int(os.getenv("BATCH_MAX", "16")),
+            max_wait=int(os.getenv("BATCH_WAIT_MS", "10")) / 1000
         )
-        self.conversation_history: Dict[str, ConversationHistory] = {}
         self.max_history = int(os.getenv("MAX_CONVERSATION_HISTORY", "10"))
+        prefix_messages = int(os.getenv("STABLE_PREFIX_TURNS", "2")) * 2
+        redis_url = os.getenv("REDIS_URL")
+        # Tails past 2*max_history are summarized; the store cap is only a backstop
+        if redis_url:
+            self.store = RedisConversationStore(
+                redis_url, prefix_messages, self.max_history * 4, int(os.getenv("SESSION_TTL", "86400"))
+            )
+        else:
+            self.store = InMemoryConversationStore(prefix_messages, self.max_history * 4)
+        self._summarizing: Set[str] = set()
+        self._summary_tasks: Set[asyncio.Task] = set()
         self.escalation_keywords = os.getenv("ESCALATION_KEYWORDS", "human,manager,supervisor,escalate").split(",")
+        # Case-fold the keywords once; messages are case-folded once per request
+        self.escalation_pattern = re.compile(
+            "|".join(re.escape(keyword.strip().casefold()) for keyword in self.escalation_keywords)
+        )
+        self.semantic_cache = None
+        if os.getenv("ENABLE_SEMANTIC_CACHE", "false").lower() == "true":
+            self.semantic_cache = SemanticCache(
+                float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9")),
+                int(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+                int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+            )
         
-    async def process_message(self, request: ChatRequest) -> ChatResponse:
+    async def process_message(self, request: ChatRequest, http_response: Optional[Response] = None) -> ChatResponse:
         """Process incoming chat message and generate response"""
         try:
-            session_id = request.session_id or f"session_{datetime.now().timestamp()}"
-            
-            # Get or create conversation history
-            if session_id not in self.conversation_history:
-                self.conversation_history[session_id] = ConversationHistory(
-                    messages=[],
-                    created_at=datetime.now(),
-                    updated_at=datetime.now()
-                )
-            
-            history = self.conversation_history[session_id]
+            session_id = request.session_id or f"session_{uuid.uuid4().hex}"
             
             # Check for escalation keywords
-            if any(keyword.lower() in request.message.lower() for keyword in self.escalation_keywords):
+            if self.escalation_pattern.search(request.message.casefold()):
                 response_text = ("I understand you'd like to speak with a human representative. "
                                "I'm transferring you to our support team. Please hold while I connect you.")
                 # In a real implementation, this would trigger escalation workflow
                 logger.info(f"Escalation triggered for session {session_id}")
             else:
                 # Prepare conversation context
-                messages = [
-                    {"role": "system", "content": "You are a helpful customer support assistant. Be friendly, professional, and helpful."}
-                ]
+                messages = [SYSTEM_MESSAGE]
                 
-                # Add conversation history
-                for msg in history.messages[-self.max_history:]:
-                    messages.append(msg)
+                # Add conversation history: frozen opening turns, summary, then only the
+                # last max_history tail messages; older ones reach the model via the summary
+                messages.extend(await self.store.history(session_id, self.max_history))
                 
                 # Add current message
                 messages.append({"role": "user", "content": request.message})
                 
-                # Generate response using OpenAI
-                response = await asyncio.to_thread(
-                    self.client.chat.completions.create,
-                    model="gpt-4",
-                    messages=messages,
-                    max_tokens=500,
-                    temperature=0.7
-                )
+                embedding = None
+                cached_text = None
+                if self.semantic_cache is not None:
+                    embedding = await asyncio.to_thread(
+                        self.semantic_cache.embed, self.semantic_cache.context_text(messages)
+                    )
+                    cached_text = await asyncio.to_thread(self.semantic_cache.lookup, embedding)
+                    if http_response is not None:
+                        http_response.headers["X-Cache"] = "HIT" if cached_text is not None else "MISS"
                 
-                response_text = response.choices[0].message.content
+                if cached_text is not None:
+                    response_text = cached_text
+                else:
+                    # Generate response using OpenAI
+                    response = await self.batcher.create(
+                        model="gpt-4",
+                        messages=messages,
+                        max_tokens=500,
+                        temperature=0.7
+                    )
+                    
+                    response_text = response.choices[0].message.content
+                    
+                    if self.semantic_cache is not None:
+                        await asyncio.to_thread(self.semantic_cache.add, embedding, response_text)
             
-            # Update conversation history
-            history.messages.extend([
+            # Append the new turn and compact the tail once it grows too long
+            tail_length = await self.store.append(session_id, [
                 {"role": "user", "content": request.message},
                 {"role": "assistant", "content": response_text}
             ])
-            history.updated_at = datetime.now()
-            
-            # Trim history if too long
-            if len(history.messages) > self.max_history * 2:
-                history.messages = history.messages[-self.max_history * 2:]
+            if tail_length > self.max_history * 2 and session_id not in self._summarizing:
+                self._summarizing.add(session_id)
+                task = asyncio.create_task(self.summarize(session_id))
+                self._summary_tasks.add(task)
+                task.add_done_callback(self._summary_tasks.discard)
             
             return ChatResponse(
                 response=response_text,
                 session_id=session_id,
-                timestamp=datetime.now().isoformat()
+                timestamp=_now_iso
             )
             
         except Exception as e:
             logger.error(f"Error processing message: {e}")
             raise HTTPException(status_code=500, detail="Internal server error")
 
+    async def summarize(self, session_id: str):
+        """Fold the oldest tail messages of a session into its rolling summary"""
+        try:
+            summary, oldest, through_seq = await self.store.oldest(session_id, self.max_history)
+            if not oldest:
+                return
+            transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in oldest)
+            if summary:
+                transcript = f"Earlier summary: {summary}\n{transcript}"
+            response = await self.client.chat.completions.create(
+                model="gpt-4",
+                messages=[{
+                    "role": "user",
+                    "content": f"Summarize the following conversation in under 200 tokens:\n\n{transcript}"
+                }],
+                max_tokens=250,
+                temperature=0.3
+            )
+            await self.store.compact(session_id, through_seq, response.choices[0].message.content)
+            logger.info(f"Summarized {len(oldest)} messages for session {session_id}")
+        except Exception as e:
+            logger.error(f"Error summarizing session {session_id}: {e}")
+        finally:
+            self._summarizing.discard(session_id)
+
 # Initialize chatbot
-chatbot = ChatbotAgent()
+chatbot = ChatbotAgent(http_client)
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+@app.post("/chat", responses={200: {"model": ChatResponse}})
+async def chat(request: ChatRequest, http_response: Response):
     """Chat endpoint for processing messages"""
-    return await chatbot.process_message(request)
+    return await chatbot.process_message(request, http_response)
 
-@app.get("/health", response_model=HealthResponse)
+@app.get("/health", responses={200: {"model": HealthResponse}})
 async def health_check():
     """Health check endpoint"""
-    import time
-    uptime = time.time() - start_time
+    uptime = time.monotonic() - start_time
     return HealthResponse(
         status="healthy",
         uptime=f"{uptime:.2f}s",
-        timestamp=datetime.now().isoformat()
+        timestamp=_now_iso
     )
 
+@app.on_event("startup")
+async def startup_event():
+    """Start the timestamp clock and the completion batcher"""
+    app.state.clock = asyncio.create_task(_tick_timestamp())
+    chatbot.batcher.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks and release the conversation store and HTTP connections"""
+    app.state.clock.cancel()
+    await chatbot.batcher.stop()
+    await chatbot.store.close()
+    await http_client.aclose()
+
 @app.get("/")
 async def root():
     """Root endpoint"""
     return {"message": "Chatbot Agent API", "status": "running", "version": "1.0.0"}
 
 if __name__ == "__main__":
-    import uvicorn
-    import time
-    
-    start_time = time.time()
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
     
     logger.info("Starting Chatbot Agent...")
+    # Multiple workers only share sessions when REDIS_URL is set
     uvicorn.run(
-        app, 
-        host="0.0.0.0", 
+        "main:app" if workers > 1 else app,
+        host="0.0.0.0",
         port=8080,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
         log_level=os.getenv("LOG_LEVEL", "info").lower()
     )
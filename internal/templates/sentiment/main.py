@@ -4,25 +4,63 @@ Sentiment Analysis Agent - Analyzes text sentiment using AI
 """
 
 import os
+import time
+import json
+import math
+import uuid
+import hashlib
+import asyncio
 import logging
 from datetime import datetime
-from typing import Dict, List, Optional
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, HttpUrl
+import httpx
 import openai
+import uvicorn
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+# Set at import so every worker process reports its own uptime; monotonic
+# time is unaffected by wall-clock adjustments
+start_time = time.monotonic()
 
 # Configure logging
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
+# Second-resolution timestamp refreshed by a background task, so responses
+# read a string instead of calling datetime.now().isoformat() each time
+_now_iso = datetime.now().isoformat(timespec="seconds")
+
+async def _tick_timestamp():
+    global _now_iso
+    while True:
+        _now_iso = datetime.now().isoformat(timespec="seconds")
+        await asyncio.sleep(1.0)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Sentiment Analysis Agent",
     description="AI-powered sentiment analysis for text content",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Shared HTTP connection pool for all OpenAI calls, sized for many
+# concurrent sessions and multiplexed over HTTP/2
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_keepalive_connections=200, max_connections=500, keepalive_expiry=30),
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=5.0)
+)
+
+SENTIMENTS = ("positive", "negative", "neutral")
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
 # Request/Response models
 class SentimentRequest(BaseModel):
     text: str
@@ -33,43 +71,245 @@ class SentimentResponse(BaseModel):
     confidence: Optional[float] = None
     timestamp: str
 
+class SentimentBatchRequest(BaseModel):
+    texts: List[str] = Field(min_length=1)
+    callback_url: Optional[HttpUrl] = None  # only http(s) URLs are accepted
+
+class SentimentBatchResponse(BaseModel):
+    job_id: str
+    batch_id: str
+    status: str
+    results: Optional[List[Optional[str]]] = None  # sentiments in the order of the submitted texts, None where a request failed
+    errors: Optional[Dict[int, str]] = None  # error messages by text index
+    timestamp: str
+
 class HealthResponse(BaseModel):
     status: str
     uptime: str
     timestamp: str
 
-class SentimentAgent:
-    def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
-        
-    async def analyze_sentiment(self, request: SentimentRequest) -> SentimentResponse:
-        """Analyze sentiment of the provided text"""
+class InMemorySentimentCache:
+    """Process-local LRU cache of sentiment labels with expiry"""
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, sentiment = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return sentiment
+
+    async def set(self, key: str, sentiment: str) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl, sentiment)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    async def close(self) -> None:
+        pass
+
+class RedisSentimentCache:
+    """Redis-backed sentiment cache shared by all workers"""
+
+    def __init__(self, url: str, ttl: int):
+        self.redis = aioredis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
         try:
-            # Prepare prompt for sentiment analysis
-            prompt = f"""Analyze the sentiment of the following text and respond with only one word: positive, negative, or neutral.
+            # GETEX refreshes the expiry so frequently analyzed texts stay cached
+            return await self.redis.getex(key, ex=self.ttl)
+        except RedisError as e:
+            logger.warning(f"Sentiment cache unavailable, treating as miss: {e}")
+            return None
 
-Text: {request.text}
+    async def set(self, key: str, sentiment: str) -> None:
+        try:
+            await self.redis.set(key, sentiment, ex=self.ttl)
+        except RedisError as e:
+            logger.warning(f"Sentiment cache unavailable, not storing: {e}")
 
-Sentiment:"""
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+class InMemoryBatchJobStore:
+    """Process-local batch job records; only the submitting worker can see them"""
+
+    def __init__(self):
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.get(job_id)
+
+    async def save(self, job_id: str, job: Dict[str, Any]) -> None:
+        self.jobs[job_id] = job
+
+    async def pending(self) -> List[str]:
+        return [job_id for job_id, job in self.jobs.items() if not job["finished"]]
+
+    async def claim(self, job_id: str, owner: str, ttl: int) -> bool:
+        # Only this process can see the job, so it always owns the poller
+        return True
+
+    async def release(self, job_id: str, owner: str) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+class RedisBatchJobStore:
+    """Redis-backed batch job records, so any worker can report a job's status.
+
+    Unfinished jobs are listed in ``batch:pending`` so pollers can be resumed
+    after a restart. ``batch:<job_id>:poller`` is a lease naming the worker
+    that polls the job, so a job is never polled by two workers at once.
+    """
+
+    def __init__(self, url: str, ttl: int):
+        self.redis = aioredis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self.redis.get(f"batch:{job_id}")
+        return json.loads(raw) if raw is not None else None
+
+    async def save(self, job_id: str, job: Dict[str, Any]) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"batch:{job_id}", json.dumps(job), ex=self.ttl)
+            if job["finished"]:
+                pipe.srem("batch:pending", job_id)
+            else:
+                pipe.sadd("batch:pending", job_id)
+            await pipe.execute()
+
+    async def pending(self) -> List[str]:
+        job_ids = sorted(await self.redis.smembers("batch:pending"))
+        if not job_ids:
+            return []
+        # Drop jobs whose records have already expired
+        exists = await self.redis.mget([f"batch:{job_id}" for job_id in job_ids])
+        expired = [job_id for job_id, raw in zip(job_ids, exists) if raw is None]
+        if expired:
+            await self.redis.srem("batch:pending", *expired)
+        return [job_id for job_id, raw in zip(job_ids, exists) if raw is not None]
+
+    async def claim(self, job_id: str, owner: str, ttl: int) -> bool:
+        key = f"batch:{job_id}:poller"
+        if await self.redis.set(key, owner, nx=True, ex=ttl):
+            return True
+        # Renew a lease this worker already holds
+        if await self.redis.get(key) == owner:
+            await self.redis.expire(key, ttl)
+            return True
+        return False
+
+    async def release(self, job_id: str, owner: str) -> None:
+        key = f"batch:{job_id}:poller"
+        if await self.redis.get(key) == owner:
+            await self.redis.delete(key)
 
-            # Generate sentiment using OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a sentiment analysis expert. Respond with only: positive, negative, or neutral."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=10,
-                temperature=0.1
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+class LocalSentimentClassifier:
+    """DistilBERT SST-2 classifier run on CPU with ONNX Runtime.
+
+    Requires the optional ``optimum[onnxruntime]`` package. ``model_name`` may
+    be a directory produced by ``optimum-cli export onnx --task
+    text-classification`` (optionally INT8-quantized with ``optimum-cli
+    onnxruntime quantize``); a Hub model ID is exported on first load.
+    """
+
+    def __init__(self, model_name: str, neutral_threshold: float = 0.6):
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = ORTModelForSequenceClassification.from_pretrained(
+            model_name, export=not os.path.isdir(model_name)
+        )
+        id2label = self.model.config.id2label
+        self.labels = [id2label[i].lower() for i in range(len(id2label))]
+        self.neutral_threshold = neutral_threshold
+
+    def classify(self, text: str) -> Tuple[str, float]:
+        """Return the sentiment label and its softmax probability"""
+        inputs = self.tokenizer(text, return_tensors="np", truncation=True)
+        logits = [float(x) for x in self.model(**inputs).logits[0]]
+        peak = max(logits)
+        exps = [math.exp(x - peak) for x in logits]
+        best = exps.index(max(exps))
+        confidence = exps[best] / sum(exps)
+        # SST-2 has no neutral class; low-confidence predictions count as neutral
+        if confidence < self.neutral_threshold:
+            return "neutral", confidence
+        return self.labels[best], confidence
+
+class SentimentAgent:
+    def __init__(self, http_client: httpx.AsyncClient):
+        self.http = http_client
+        self.client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=http_client
+        )
+        self.batch_poll_interval = float(os.getenv("BATCH_POLL_INTERVAL", "60"))
+        # Running pollers by job ID; leases outlast a few missed polls
+        self.pollers: Dict[str, asyncio.Task] = {}
+        self.poller_id = uuid.uuid4().hex
+        self.poller_lease = int(max(self.batch_poll_interval * 3, 30))
+        cache_ttl = int(os.getenv("SENTIMENT_CACHE_TTL", "86400"))
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            self.cache = RedisSentimentCache(redis_url, cache_ttl)
+            # Jobs outlive the 24h completion window so results can still be fetched
+            self.batch_jobs = RedisBatchJobStore(redis_url, int(os.getenv("BATCH_JOB_TTL", "604800")))
+        else:
+            self.cache = InMemorySentimentCache(int(os.getenv("SENTIMENT_CACHE_SIZE", "10000")), cache_ttl)
+            self.batch_jobs = InMemoryBatchJobStore()
+        self.classifier = None
+        if os.getenv("SENTIMENT_BACKEND", "openai").lower() == "local":
+            self.classifier = LocalSentimentClassifier(
+                os.getenv("SENTIMENT_MODEL", "distilbert-base-uncased-finetuned-sst-2-english"),
+                float(os.getenv("SENTIMENT_NEUTRAL_THRESHOLD", "0.6"))
             )
+        
+    async def analyze_sentiment(self, request: SentimentRequest, http_response: Optional[Response] = None) -> SentimentResponse:
+        """Analyze sentiment of the provided text"""
+        try:
+            if self.classifier is not None:
+                # Local inference is cheaper than a cache round trip and yields a real score
+                sentiment, score = await asyncio.to_thread(self.classifier.classify, request.text)
+                return SentimentResponse(
+                    sentiment=sentiment,
+                    confidence=score if request.include_confidence else None,
+                    timestamp=_now_iso
+                )
             
-            sentiment = response.choices[0].message.content.strip().lower()
+            # Analysis is near-deterministic, so identical texts reuse the cached label
+            cache_key = "sent:" + hashlib.sha256(request.text.strip().lower().encode()).hexdigest()
+            sentiment = await self.cache.get(cache_key)
+            if http_response is not None:
+                http_response.headers["X-Cache"] = "HIT" if sentiment is not None else "MISS"
             
-            # Validate sentiment
-            if sentiment not in ["positive", "negative", "neutral"]:
-                sentiment = "neutral"
+            if sentiment is None:
+                # Generate sentiment using OpenAI
+                response = await self.client.chat.completions.create(
+                    model="gpt-4",
+                    messages=self._build_messages(request.text),
+                    max_tokens=10,
+                    temperature=0.1
+                )
+                
+                sentiment = self._normalize_sentiment(response.choices[0].message.content)
+                await self.cache.set(cache_key, sentiment)
             
             # Calculate confidence (simplified approach)
             confidence = None
@@ -79,47 +319,230 @@ Sentiment:"""
             return SentimentResponse(
                 sentiment=sentiment,
                 confidence=confidence,
-                timestamp=datetime.now().isoformat()
+                timestamp=_now_iso
             )
             
         except Exception as e:
             logger.error(f"Error analyzing sentiment: {e}")
             raise HTTPException(status_code=500, detail="Internal server error")
 
+    async def submit_batch(self, request: SentimentBatchRequest) -> SentimentBatchResponse:
+        """Submit texts to the OpenAI Batch API (half price, completes within 24h)"""
+        try:
+            lines = [
+                json.dumps({
+                    "custom_id": f"s-{i}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": "gpt-4",
+                        "messages": self._build_messages(text),
+                        "max_tokens": 10,
+                        "temperature": 0.1
+                    }
+                })
+                for i, text in enumerate(request.texts)
+            ]
+            batch_file = await self.client.files.create(
+                file=("sentiment_batch.jsonl", "\n".join(lines).encode()),
+                purpose="batch"
+            )
+            batch = await self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+        except Exception as e:
+            logger.error(f"Error submitting sentiment batch: {e}")
+            raise HTTPException(status_code=500, detail="Internal server error")
+        
+        job_id = f"job_{uuid.uuid4().hex}"
+        await self.batch_jobs.save(job_id, {
+            "batch_id": batch.id,
+            "status": batch.status,
+            "size": len(request.texts),
+            "callback_url": str(request.callback_url) if request.callback_url else None,
+            "results": None,
+            "errors": None,
+            "finished": False
+        })
+        logger.info(f"Submitted sentiment batch {batch.id} as {job_id} ({len(request.texts)} texts)")
+        return await self.get_batch(job_id)
+
+    async def get_batch(self, job_id: str) -> SentimentBatchResponse:
+        """Return the current state of a batch job"""
+        job = await self.batch_jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Batch job not found")
+        return SentimentBatchResponse(
+            job_id=job_id,
+            batch_id=job["batch_id"],
+            status=job["status"],
+            results=job["results"],
+            errors=job["errors"],
+            timestamp=_now_iso
+        )
+
+    def start_polling(self, job_id: str) -> None:
+        """Poll a batch job in a tracked task that is cancelled on shutdown"""
+        if job_id in self.pollers:
+            return
+        task = asyncio.create_task(self.poll_batch(job_id))
+        self.pollers[job_id] = task
+        task.add_done_callback(lambda _: self.pollers.pop(job_id, None))
+
+    async def resume_batches(self) -> None:
+        """Restart polling for jobs left unfinished by a previous process"""
+        for job_id in await self.batch_jobs.pending():
+            self.start_polling(job_id)
+
+    async def stop_polling(self) -> None:
+        """Cancel running pollers; unfinished jobs are resumed on the next startup"""
+        tasks = list(self.pollers.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def poll_batch(self, job_id: str):
+        """Poll a batch until it finishes, then collect results and notify the callback"""
+        try:
+            job = await self.batch_jobs.get(job_id)
+            if job is None or job["finished"]:
+                return
+            while True:
+                # Another worker holds the lease and is already polling this job
+                if not await self.batch_jobs.claim(job_id, self.poller_id, self.poller_lease):
+                    return
+                batch = await self.client.batches.retrieve(job["batch_id"])
+                if batch.status != job["status"]:
+                    job["status"] = batch.status
+                    await self.batch_jobs.save(job_id, job)
+                if batch.status in BATCH_TERMINAL_STATUSES:
+                    break
+                await asyncio.sleep(self.batch_poll_interval)
+            
+            # Failed and expired batches may still have partial output
+            results: List[Optional[str]] = [None] * job["size"]
+            errors: Dict[int, str] = {}
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = await self.client.files.content(file_id)
+                    self._parse_batch_output(content.text, results, errors)
+            for index, sentiment in enumerate(results):
+                if sentiment is None and index not in errors:
+                    errors[index] = f"No result, batch {batch.status}"
+            job["results"] = results
+            job["errors"] = errors or None
+            job["finished"] = True
+            await self.batch_jobs.save(job_id, job)
+            logger.info(f"Sentiment batch {job['batch_id']} finished with status {batch.status}")
+            
+            if job["callback_url"]:
+                await self.http.post(job["callback_url"], json=(await self.get_batch(job_id)).model_dump())
+        except Exception as e:
+            logger.error(f"Error processing sentiment batch {job_id}: {e}")
+        finally:
+            try:
+                await self.batch_jobs.release(job_id, self.poller_id)
+            except Exception as e:
+                logger.warning(f"Could not release poller lease for batch job {job_id}: {e}")
+
+    def _build_messages(self, text: str) -> List[Dict[str, str]]:
+        # Prepare prompt for sentiment analysis
+        prompt = f"""Analyze the sentiment of the following text and respond with only one word: positive, negative, or neutral.
+
+Text: {text}
+
+Sentiment:"""
+        return [
+            {"role": "system", "content": "You are a sentiment analysis expert. Respond with only: positive, negative, or neutral."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _normalize_sentiment(self, content: Optional[str]) -> str:
+        sentiment = (content or "").strip().lower()
+        # Validate sentiment
+        return sentiment if sentiment in SENTIMENTS else "neutral"
+
+    def _parse_batch_output(self, output: str, results: List[Optional[str]], errors: Dict[int, str]) -> None:
+        """Fill in results, or errors for failed requests, from a batch output or error file"""
+        for line in output.splitlines():
+            if not line:
+                continue
+            item = json.loads(line)
+            index = int(item["custom_id"].split("-", 1)[1])
+            response = item.get("response") or {}
+            body = response.get("body") or {}
+            choices = body.get("choices") or []
+            if response.get("status_code") == 200 and choices:
+                results[index] = self._normalize_sentiment(choices[0]["message"]["content"])
+            else:
+                error = item.get("error") or body.get("error") or {}
+                errors[index] = error.get("message") or f"Request failed with status {response.get('status_code')}"
+
 # Initialize sentiment agent
-sentiment_agent = SentimentAgent()
+sentiment_agent = SentimentAgent(http_client)
 
-@app.post("/analyze", response_model=SentimentResponse)
-async def analyze_sentiment(request: SentimentRequest):
+@app.post("/analyze", responses={200: {"model": SentimentResponse}})
+async def analyze_sentiment(request: SentimentRequest, http_response: Response):
     """Analyze sentiment of provided text"""
-    return await sentiment_agent.analyze_sentiment(request)
+    return await sentiment_agent.analyze_sentiment(request, http_response)
 
-@app.get("/health", response_model=HealthResponse)
+@app.post("/analyze_batch", responses={200: {"model": SentimentBatchResponse}})
+async def analyze_batch(request: SentimentBatchRequest):
+    """Submit texts for asynchronous batch analysis"""
+    job = await sentiment_agent.submit_batch(request)
+    sentiment_agent.start_polling(job.job_id)
+    return job
+
+@app.get("/analyze_batch/{job_id}", responses={200: {"model": SentimentBatchResponse}})
+async def get_batch(job_id: str):
+    """Get the status and results of a batch job"""
+    return await sentiment_agent.get_batch(job_id)
+
+@app.get("/health", responses={200: {"model": HealthResponse}})
 async def health_check():
     """Health check endpoint"""
-    import time
-    uptime = time.time() - start_time
+    uptime = time.monotonic() - start_time
     return HealthResponse(
         status="healthy",
         uptime=f"{uptime:.2f}s",
-        timestamp=datetime.now().isoformat()
+        timestamp=_now_iso
     )
 
+@app.on_event("startup")
+async def startup_event():
+    """Start the timestamp clock and resume polling unfinished batch jobs"""
+    app.state.clock = asyncio.create_task(_tick_timestamp())
+    try:
+        await sentiment_agent.resume_batches()
+    except Exception as e:
+        logger.error(f"Could not resume sentiment batch jobs: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the clock and batch pollers, then release cache and pooled HTTP connections"""
+    app.state.clock.cancel()
+    await sentiment_agent.stop_polling()
+    await sentiment_agent.cache.close()
+    await sentiment_agent.batch_jobs.close()
+    await http_client.aclose()
+
 @app.get("/")
 async def root():
     """Root endpoint"""
     return {"message": "Sentiment Analysis Agent API", "status": "running", "version": "1.0.0"}
 
 if __name__ == "__main__":
-    import uvicorn
-    import time
-    
-    start_time = time.time()
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
     
     logger.info("Starting Sentiment Analysis Agent...")
     uvicorn.run(
-        app, 
-        host="0.0.0.0", 
+        "main:app" if workers > 1 else app,
+        host="0.0.0.0",
         port=8080,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
         log_level=os.getenv("LOG_LEVEL", "info").lower()
     )
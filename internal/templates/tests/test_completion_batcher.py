@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for CompletionBatcher, which groups concurrent chat completions
+
+The OpenAI client is replaced by a stub whose ``create`` echoes the prompt
+back, so each caller can check it received its own completion.
+"""
+
+import asyncio
+import importlib.util
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# The template lives in the embedded chatbot/ tree, which is copied into
+# generated projects, so its tests sit here and load main.py by path
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+_spec = importlib.util.spec_from_file_location(
+    "chatbot_agent_main", Path(__file__).resolve().parents[1] / "chatbot" / "main.py"
+)
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+class CompletionsStub:
+    """Stands in for ``client.chat.completions``"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **params):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        prompt = params["messages"][0]["content"]
+        if prompt == "fail":
+            raise RuntimeError("upstream failure")
+        return f"reply to {prompt}"
+
+def make_batcher(max_batch: int = 4, max_wait: float = 0.05):
+    completions = CompletionsStub()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return main.CompletionBatcher(client, max_batch=max_batch, max_wait=max_wait), completions
+
+def params(prompt: str) -> dict:
+    return {"model": "gpt-4", "messages": [{"role": "user", "content": prompt}]}
+
+class TestCompletionBatcher:
+    """Test batching, result routing and error isolation"""
+
+    def test_each_caller_gets_its_own_completion(self):
+        async def scenario():
+            batcher, completions = make_batcher()
+            batcher.start()
+            try:
+                results = await asyncio.gather(*(batcher.create(**params(f"q{i}")) for i in range(10)))
+            finally:
+                await batcher.stop()
+            return results, completions.calls, batcher.in_flight
+
+        results, calls, in_flight = asyncio.run(scenario())
+
+        assert results == [f"reply to q{i}" for i in range(10)]
+        assert calls == 10
+        assert in_flight == 0
+
+    def test_concurrent_requests_are_dispatched_in_batches(self):
+        async def scenario():
+            batcher, _ = make_batcher(max_batch=4)
+            sizes = []
+            dispatch = batcher._dispatch
+
+            async def recording_dispatch(batch):
+                sizes.append(len(batch))
+                await dispatch(batch)
+
+            batcher._dispatch = recording_dispatch
+            batcher.start()
+            try:
+                await asyncio.gather(*(batcher.create(**params(f"q{i}")) for i in range(9)))
+            finally:
+                await batcher.stop()
+            return sizes
+
+        sizes = asyncio.run(scenario())
+
+        # The first request finds nothing in flight and is sent straight away;
+        # the other eight queue behind it and leave in batches of max_batch
+        assert sizes == [4, 4]
+
+    def test_failure_reaches_only_its_own_caller(self):
+        async def scenario():
+            batcher, _ = make_batcher()
+            batcher.start()
+            try:
+                return await asyncio.gather(
+                    *(batcher.create(**params(prompt)) for prompt in ["a", "fail", "b", "c"]),
+                    return_exceptions=True
+                )
+            finally:
+                await batcher.stop()
+
+        results = asyncio.run(scenario())
+
+        assert results[0] == "reply to a"
+        assert isinstance(results[1], RuntimeError)
+        assert results[2:] == ["reply to b", "reply to c"]
+
+    def test_requests_go_direct_when_batcher_is_not_running(self):
+        async def scenario():
+            batcher, completions = make_batcher()
+            results = await asyncio.gather(*(batcher.create(**params(f"q{i}")) for i in range(3)))
+            return results, completions.calls, batcher.queue.qsize()
+
+        results, calls, queued = asyncio.run(scenario())
+
+        assert results == ["reply to q0", "reply to q1", "reply to q2"]
+        assert calls == 3
+        assert queued == 0
+
+    def test_caller_failure_propagates_when_sent_directly(self):
+        async def scenario():
+            batcher, _ = make_batcher()
+            await batcher.create(**params("fail"))
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(scenario())
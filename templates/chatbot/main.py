@@ -5,34 +5,140 @@ Supports both OpenAI and Ollama (local) models
 """
 
 import os
+import re
 import json
+import time
+import asyncio
+import uuid
+import hashlib
 import logging
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+import functools
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple, Union
+from datetime import datetime, timezone
+from enum import Enum
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import requests
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+import httpx
+import msgspec
+import orjson
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
 
 # Configure logging
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build per-worker clients once the event loop exists, and close them on shutdown"""
+    logger.info("🚀 Starting AI Agent Chatbot")
+    logger.info(f"📡 Provider: {MODEL_PROVIDER}")
+    logger.info(f"🤖 Model: {MODEL_NAME}")
+    
+    if PROVIDER is Provider.OLLAMA:
+        logger.info(f"🔗 Ollama URL: {OLLAMA_BASE_URL}")
+        logger.info("💡 Make sure Ollama is running: ollama serve")
+    
+    # One pooled client for every upstream call, so keep-alive connections are reused.
+    # Pool and HTTP/2 settings live on the transport; httpx ignores the client-level
+    # ones when a transport is given. Concurrent OpenAI calls multiplex over one socket.
+    app.state.http = httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=1,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60.0)
+        ),
+        timeout=httpx.Timeout(30.0, connect=5.0)
+    )
+    app.state.llm = create_llm_client(app.state.http)
+    # In-flight LLM calls keyed by cache key, for coalescing identical prompts
+    app.state.inflight = {}
+    
+    try:
+        # Pay connection setup and model load now rather than on the first /chat;
+        # an unreachable provider aborts startup
+        started = time.perf_counter()
+        await app.state.llm.warm_up()
+        logger.info(f"🔥 {MODEL_PROVIDER} warm-up took {(time.perf_counter() - started) * 1000:.0f}ms")
+        
+        logger.info("✅ Chatbot is ready!")
+        yield
+    finally:
+        await app.state.http.aclose()
+        if response_cache is not None:
+            await response_cache.close()
+        if semantic_cache is not None:
+            await semantic_cache.close()
+
 # FastAPI app
-app = FastAPI(title="AI Agent Chatbot", version="1.0.0")
+app = FastAPI(title="AI Agent Chatbot", version="1.0.0", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+class Provider(str, Enum):
+    OPENAI = "openai"
+    OLLAMA = "ollama"
 
 # Configuration
 MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai")
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+REDIS_URL = os.getenv("REDIS_URL")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # 0 disables caching
+ENABLE_SEMANTIC_CACHE = os.getenv("ENABLE_SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+MODELS_CACHE_TTL = 30  # seconds to reuse Ollama's tag list
+TEMPERATURE = 0.7
+MAX_TOKENS = 500
+
+# Resolved once so a bad MODEL_PROVIDER fails at import, not on the first request
+try:
+    PROVIDER = Provider(MODEL_PROVIDER.lower())
+except ValueError:
+    raise ValueError(f"Unsupported provider: {MODEL_PROVIDER}. Use 'openai' or 'ollama'")
 
 # Request/Response models
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct, forbid_unknown_fields=True, frozen=True):
+    """Decoded by msgspec straight from the body; cheaper than pydantic validation"""
     message: str
     conversation_id: Optional[str] = None
 
+# msgspec models aren't visible to FastAPI, so describe the /chat body by hand
+CHAT_REQUEST_SCHEMA = msgspec.json.schema_components([ChatRequest])[1]["ChatRequest"]
+
+# FastAPI's 422 body, documented explicitly since /chat has no declared body parameter
+class ValidationErrorItem(BaseModel):
+    loc: List[Union[str, int]]
+    msg: str
+    type: str
+
+class ValidationErrorResponse(BaseModel):
+    detail: List[ValidationErrorItem]
+
+def validation_errors(error: msgspec.DecodeError) -> List[Dict[str, Any]]:
+    """Translate a msgspec error into FastAPI's [{"loc", "msg", "type"}] shape"""
+    if not isinstance(error, msgspec.ValidationError):
+        return [{"loc": ["body"], "msg": str(error), "type": "json_invalid"}]
+    # Messages look like "Expected `str`, got `int` - at `$.message`"
+    msg, _, path = str(error).partition(" - at `$")
+    loc: List[Union[str, int]] = ["body"]
+    for key, index in re.findall(r"\.([^.\[`]+)|\[(\d+)\]", path):
+        loc.append(key if key else int(index))
+    missing = re.match(r"Object missing required field `([^`]+)`", msg)
+    if missing:
+        return [{"loc": loc + [missing.group(1)], "msg": "Field required", "type": "missing"}]
+    return [{"loc": loc, "msg": msg, "type": "value_error"}]
+
 class ChatResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+    
     response: str
     conversation_id: str
     provider: str
@@ -40,6 +146,8 @@ class ChatResponse(BaseModel):
     timestamp: str
 
 class HealthResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+    
     status: str
     provider: str
     model: str
@@ -49,46 +157,96 @@ class HealthResponse(BaseModel):
 class LLMClient:
     """Base LLM client interface"""
     
-    def chat(self, message: str, conversation_id: str = None) -> str:
+    async def chat(self, message: str, conversation_id: str = None) -> str:
+        raise NotImplementedError
+    
+    def stream(self, message: str, conversation_id: str = None) -> AsyncIterator[str]:
+        """Yield response text as the model generates it"""
+        raise NotImplementedError
+    
+    async def warm_up(self) -> None:
+        """Open a pooled connection and check the model before the first request"""
         raise NotImplementedError
 
 class OpenAIClient(LLMClient):
     """OpenAI API client"""
     
-    def __init__(self, api_key: str, model: str):
+    def __init__(self, api_key: str, model: str, http: httpx.AsyncClient):
         self.api_key = api_key
         self.model = model
         self.base_url = "https://api.openai.com/v1"
+        self.http = http
         
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY environment variable is required for OpenAI models")
-    
-    def chat(self, message: str, conversation_id: str = None) -> str:
-        headers = {
+        
+        # Built once; only the messages differ between requests
+        self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
-        payload = {
+        self.url = f"{self.base_url}/chat/completions"
+        self.payload_template = {
             "model": self.model,
+            "max_tokens": MAX_TOKENS,
+            "temperature": TEMPERATURE
+        }
+    
+    def _payload(self, message: str, stream: bool = False) -> Dict[str, Any]:
+        return {
+            **self.payload_template,
             "messages": [
                 {"role": "user", "content": message}
             ],
-            "max_tokens": 500,
-            "temperature": 0.7
+            "stream": stream
         }
-        
+    
+    async def warm_up(self) -> None:
+        # Completes DNS + TLS and confirms the key can see the configured model
+        response = await self.http.get(f"{self.base_url}/models/{self.model}", headers=self.headers, timeout=10)
+        if response.status_code != 200:
+            raise RuntimeError(f"OpenAI model check failed ({response.status_code}): {response.text}")
+        logger.info(f"🔌 OpenAI connection negotiated {response.http_version}")
+    
+    async def chat(self, message: str, conversation_id: str = None) -> str:
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=payload,
+            response = await self.http.post(
+                self.url,
+                headers=self.headers,
+                json=self._payload(message),
                 timeout=30
             )
             response.raise_for_status()
             
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
+            # A full orjson parse of the raw bytes; the body is small and pretty-printed,
+            # so byte-scanning for the content field would save little and break easily
+            return orjson.loads(response.content)["choices"][0]["message"]["content"]
+            
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+    
+    async def stream(self, message: str, conversation_id: str = None) -> AsyncIterator[str]:
+        try:
+            async with self.http.stream(
+                "POST",
+                self.url,
+                headers=self.headers,
+                json=self._payload(message, stream=True),
+                timeout=30
+            ) as response:
+                response.raise_for_status()
+                
+                # Server-sent events: one "data: {...}" line per chunk
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        break
+                    choices = orjson.loads(data)["choices"]
+                    if choices and choices[0]["delta"].get("content"):
+                        yield choices[0]["delta"]["content"]
             
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
@@ -97,33 +255,86 @@ class OpenAIClient(LLMClient):
 class OllamaClient(LLMClient):
     """Ollama local LLM client"""
     
-    def __init__(self, base_url: str, model: str):
+    def __init__(self, base_url: str, model: str, http: httpx.AsyncClient):
         self.base_url = base_url.rstrip('/')
         self.model = model
+        self.http = http
+        self.url = f"{self.base_url}/api/generate"
+        self.options = {
+            "temperature": TEMPERATURE,
+            "num_predict": MAX_TOKENS
+        }
     
-    def chat(self, message: str, conversation_id: str = None) -> str:
-        payload = {
+    def _payload(self, message: str, stream: bool = False) -> Dict[str, Any]:
+        return {
             "model": self.model,
             "prompt": message,
-            "stream": False,
-            "options": {
-                "temperature": 0.7,
-                "num_predict": 500
-            }
+            "stream": stream,
+            "options": self.options
         }
+    
+    async def warm_up(self) -> None:
+        try:
+            response = await self.http.get(f"{self.base_url}/api/tags", timeout=10)
+            response.raise_for_status()
+        except httpx.ConnectError:
+            raise RuntimeError("Ollama is not running. Please start Ollama with 'ollama serve'")
+        
+        models = {model["name"] for model in orjson.loads(response.content).get("models", [])}
+        if self.model not in models and f"{self.model}:latest" not in models:
+            raise RuntimeError(f"Ollama model '{self.model}' is not pulled. Run 'ollama pull {self.model}'")
         
+        # A one-token generation forces the weights into memory
+        response = await self.http.post(
+            self.url,
+            json={"model": self.model, "prompt": " ", "stream": False, "options": {"num_predict": 1}},
+            timeout=120
+        )
+        response.raise_for_status()
+    
+    async def chat(self, message: str, conversation_id: str = None) -> str:
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
+            response = await self.http.post(
+                self.url,
+                json=self._payload(message),
                 timeout=60  # Longer timeout for local models
             )
             response.raise_for_status()
             
-            result = response.json()
+            result = orjson.loads(response.content)
             return result.get("response", "No response generated")
             
-        except requests.exceptions.ConnectionError:
+        except httpx.ConnectError:
+            logger.error("Cannot connect to Ollama. Make sure Ollama is running: ollama serve")
+            raise HTTPException(
+                status_code=503, 
+                detail="Ollama is not running. Please start Ollama with 'ollama serve'"
+            )
+        except Exception as e:
+            logger.error(f"Ollama API error: {e}")
+            raise HTTPException(status_code=500, detail=f"Ollama API error: {str(e)}")
+    
+    async def stream(self, message: str, conversation_id: str = None) -> AsyncIterator[str]:
+        try:
+            async with self.http.stream(
+                "POST",
+                self.url,
+                json=self._payload(message, stream=True),
+                timeout=60
+            ) as response:
+                response.raise_for_status()
+                
+                # Newline-delimited JSON: one object per generated chunk
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = orjson.loads(line)
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        break
+            
+        except httpx.ConnectError:
             logger.error("Cannot connect to Ollama. Make sure Ollama is running: ollama serve")
             raise HTTPException(
                 status_code=503, 
@@ -133,111 +344,481 @@ class OllamaClient(LLMClient):
             logger.error(f"Ollama API error: {e}")
             raise HTTPException(status_code=500, detail=f"Ollama API error: {str(e)}")
 
+# Response caches
+class ExactMatchCache:
+    """Cache LLM responses for identical requests, with a TTL.
+
+    Entries live in process memory, or in Redis when a URL is given so all
+    workers share hits. Redis failures are logged and treated as misses, so
+    the cache is never a hard dependency of /chat.
+    """
+    
+    def __init__(self, ttl_seconds: int = 3600, max_entries: int = 10000, redis_url: Optional[str] = None):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.cache: Dict[str, Tuple[str, float]] = {}
+        self.redis = aioredis.from_url(redis_url, decode_responses=True) if redis_url else None
+    
+    def make_key(self, **params: Any) -> str:
+        return "llm:" + hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    
+    async def get(self, key: str) -> Optional[str]:
+        if self.redis is not None:
+            try:
+                return await self.redis.get(key)
+            except RedisError as e:
+                logger.warning(f"Response cache unavailable, treating as miss: {e}")
+                return None
+        
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        response, created_at = entry
+        if time.time() - created_at > self.ttl:
+            del self.cache[key]
+            return None
+        return response
+    
+    async def set(self, key: str, response: str) -> None:
+        if self.redis is not None:
+            try:
+                await self.redis.set(key, response, ex=self.ttl)
+            except RedisError as e:
+                logger.warning(f"Response cache unavailable, not storing: {e}")
+            return
+        
+        if key not in self.cache and len(self.cache) >= self.max_entries:
+            # Evict the oldest entry
+            self.cache.pop(next(iter(self.cache)))
+        self.cache[key] = (response, time.time())
+    
+    async def close(self) -> None:
+        if self.redis is not None:
+            await self.redis.aclose()
+
+class SemanticCache:
+    """Serve cached responses for prompts similar to ones already answered.
+
+    Requires the optional ``fastembed`` and ``faiss-cpu`` packages. Like
+    ``ExactMatchCache`` entries expire after a TTL and the oldest are evicted
+    past ``max_entries``, which also bounds the brute-force search. When a Redis
+    URL is given, entries are appended to a shared list and every worker folds
+    new ones into its local index before searching, so all workers share hits.
+    The list is trimmed to ``max_entries`` and expires with the TTL. Each
+    entry is ``<seq>:`` followed by the raw float32 vector and a small JSON
+    trailer, so a worker catching up decodes a few KB of bytes per entry
+    rather than parsing a JSON list of floats.
+    """
+    
+    REDIS_KEY = "semcache:entries:v2"
+    # Sequence number of the newest entry; entries hold contiguous numbers
+    REDIS_SEQ_KEY = "semcache:seq"
+    # Set when the sequence starts over, so workers notice a flush or expiry
+    REDIS_GENERATION_KEY = "semcache:generation"
+    
+    # Number, append and bound an entry atomically so list order matches sequence order
+    ADD_SCRIPT = """
+    local seq = redis.call('INCR', KEYS[2])
+    if seq == 1 then
+        redis.call('SET', KEYS[3], ARGV[2])
+    end
+    redis.call('RPUSH', KEYS[1], string.format('%d:', seq) .. ARGV[1])
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[3]), -1)
+    for _, key in ipairs(KEYS) do
+        redis.call('EXPIRE', key, ARGV[4])
+    end
+    """
+    
+    def __init__(self, threshold: float = 0.9, ttl_seconds: int = 3600, max_entries: int = 10000,
+                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2", redis_url: Optional[str] = None):
+        from fastembed import TextEmbedding
+        import faiss
+        
+        self.model = TextEmbedding(model_name)
+        self.faiss = faiss
+        dimension = len(next(iter(self.model.embed(["dimension probe"]))))
+        # Inner product over L2-normalized embeddings is cosine similarity
+        self.index = faiss.IndexFlatIP(dimension)
+        # Entries are appended in time order, so the oldest are always at the front
+        self.responses: List[str] = []
+        self.created: List[float] = []
+        self.threshold = threshold
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        # Searches and adds run in worker threads; faiss indexes aren't safe for concurrent writes
+        self.lock = threading.Lock()
+        self.redis = aioredis.from_url(redis_url) if redis_url else None
+        self.sync_lock = asyncio.Lock()
+        if self.redis is not None:
+            self.add_script = self.redis.register_script(self.ADD_SCRIPT)
+        # Generation and newest sequence number already folded into the local index
+        self.generation: Optional[bytes] = None
+        self.synced_seq = 0
+        # Repeated prompts skip the model entirely; per instance, so a new model starts empty
+        self._embed_bytes = functools.lru_cache(maxsize=4096)(self._embed_bytes)
+    
+    def _embed_bytes(self, prompt: str) -> bytes:
+        import numpy as np
+        
+        vectors = np.stack(list(self.model.embed([prompt]))).astype("float32")
+        self.faiss.normalize_L2(vectors)
+        # Immutable bytes, so a cached entry can't be altered by a caller
+        return vectors.tobytes()
+    
+    def embed(self, text: str):
+        """Embed a prompt; CPU-bound, so call it from a worker thread"""
+        import numpy as np
+        
+        data = self._embed_bytes(text.lower().strip())
+        return np.frombuffer(data, dtype="float32").reshape(1, -1).copy()
+    
+    def _evict(self) -> None:
+        """Drop expired entries and any beyond max_entries; call with the lock held"""
+        import numpy as np
+        
+        cutoff = time.time() - self.ttl
+        count = max(len(self.responses) - self.max_entries, 0)
+        while count < len(self.created) and self.created[count] < cutoff:
+            count += 1
+        if count:
+            self.index.remove_ids(np.arange(count, dtype="int64"))
+            del self.responses[:count]
+            del self.created[:count]
+    
+    def _search(self, vectors) -> Optional[str]:
+        with self.lock:
+            self._evict()
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vectors, 1)
+            if scores[0, 0] >= self.threshold:
+                return self.responses[ids[0, 0]]
+            return None
+    
+    def _add(self, vectors, responses: List[str], created: Optional[List[float]] = None) -> None:
+        with self.lock:
+            self.index.add(vectors)
+            self.responses.extend(responses)
+            self.created.extend(created or [time.time()] * len(responses))
+            self._evict()
+    
+    def _add_entries(self, entries: List[bytes], after_seq: int) -> int:
+        """Decode and index Redis entries newer than ``after_seq``; returns the newest sequence number"""
+        import numpy as np
+        
+        width = self.index.d * 4
+        vectors, responses, created = [], [], []
+        for entry in entries:
+            seq, _, payload = entry.partition(b":")
+            if int(seq) <= after_seq:
+                continue
+            after_seq = int(seq)
+            vectors.append(payload[:width])
+            trailer = orjson.loads(payload[width:])
+            responses.append(trailer["response"])
+            created.append(trailer["created"])
+        if vectors:
+            matrix = np.frombuffer(b"".join(vectors), dtype="float32").reshape(-1, self.index.d).copy()
+            self._add(matrix, responses, created)
+        return after_seq
+    
+    def _reset(self) -> None:
+        with self.lock:
+            self.index.reset()
+            self.responses.clear()
+            self.created.clear()
+    
+    async def _sync(self) -> None:
+        """Pull entries other workers have added since the last sync"""
+        async with self.sync_lock:
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.get(self.REDIS_GENERATION_KEY)
+                    pipe.get(self.REDIS_SEQ_KEY)
+                    pipe.llen(self.REDIS_KEY)
+                    generation, seq, length = await pipe.execute()
+                
+                if generation != self.generation:
+                    # Flushed, expired or restarted: what we hold no longer matches the list
+                    await run_in_threadpool(self._reset)
+                    self.generation = generation
+                    self.synced_seq = 0
+                seq = int(seq or 0)
+                # Entries hold contiguous sequence numbers, so the new ones are the last few;
+                # any trimmed before this worker saw them are simply skipped
+                new = min(seq - self.synced_seq, length)
+                if new <= 0:
+                    return
+                entries = await self.redis.lrange(self.REDIS_KEY, -new, -1)
+            except RedisError as e:
+                # Search what this worker already has
+                logger.warning(f"Semantic cache sync failed: {e}")
+                return
+            
+            # A cold worker may pull max_entries at once, so decode off the event loop
+            self.synced_seq = await run_in_threadpool(self._add_entries, entries, self.synced_seq)
+    
+    async def lookup(self, vectors) -> Optional[str]:
+        if self.redis is not None:
+            await self._sync()
+        # Brute-force search grows with the cache, so keep it off the event loop
+        return await run_in_threadpool(self._search, vectors)
+    
+    async def add(self, vectors, response: str) -> None:
+        if self.redis is not None:
+            # Indexed locally on the next sync, like entries from other workers
+            entry = vectors[0].astype("float32").tobytes() + orjson.dumps({"response": response, "created": time.time()})
+            try:
+                await self.add_script(
+                    keys=[self.REDIS_KEY, self.REDIS_SEQ_KEY, self.REDIS_GENERATION_KEY],
+                    args=[
+                        entry,
+                        uuid.uuid4().hex,
+                        self.max_entries,
+                        self.ttl
+                    ]
+                )
+            except RedisError as e:
+                logger.warning(f"Semantic cache unavailable, not storing: {e}")
+            return
+        await run_in_threadpool(self._add, vectors, [response])
+    
+    async def close(self) -> None:
+        if self.redis is not None:
+            await self.redis.aclose()
+
 # Initialize LLM client based on provider
-def create_llm_client() -> LLMClient:
+def create_llm_client(http: httpx.AsyncClient) -> LLMClient:
     """Create appropriate LLM client based on configuration"""
-    provider = MODEL_PROVIDER.lower()
-    
-    if provider == "ollama":
+    if PROVIDER is Provider.OLLAMA:
         logger.info(f"Initializing Ollama client with model: {MODEL_NAME}")
-        return OllamaClient(OLLAMA_BASE_URL, MODEL_NAME)
-    
-    elif provider == "openai":
-        logger.info(f"Initializing OpenAI client with model: {MODEL_NAME}")
-        return OpenAIClient(OPENAI_API_KEY, MODEL_NAME)
+        return OllamaClient(OLLAMA_BASE_URL, MODEL_NAME, http)
     
-    else:
-        raise ValueError(f"Unsupported provider: {provider}. Use 'openai' or 'ollama'")
+    logger.info(f"Initializing OpenAI client with model: {MODEL_NAME}")
+    return OpenAIClient(OPENAI_API_KEY, MODEL_NAME, http)
 
-# Global LLM client
-llm_client = create_llm_client()
+# The LLM client itself is built per worker in lifespan, as app.state.llm
+response_cache = ExactMatchCache(ttl_seconds=RESPONSE_CACHE_TTL, redis_url=REDIS_URL) if RESPONSE_CACHE_TTL > 0 else None
+semantic_cache = SemanticCache(
+    SEMANTIC_CACHE_THRESHOLD,
+    ttl_seconds=SEMANTIC_CACHE_TTL,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    redis_url=REDIS_URL
+) if ENABLE_SEMANTIC_CACHE else None
+# (expires_at, body) of the last Ollama /api/tags response
+models_cache: Optional[Tuple[float, bytes]] = None
 
 # API Endpoints
+@functools.lru_cache(maxsize=1)
+def _iso_now(sec: int) -> str:
+    """ISO-8601 UTC timestamp, formatted once per second"""
+    return datetime.fromtimestamp(sec, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# Reported by / and /health so they never format a timestamp per request
+BUILD_TIME = _iso_now(int(time.time()))
+
+def etag_response(http_request: Request, body: bytes, max_age: int) -> Response:
+    """Serve a JSON body with ETag/Cache-Control, or 304 if the client already has it"""
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if http_request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# /, /health and the OpenAI /models body never change while the process runs
+ROOT_BODY = orjson.dumps({
+    "message": "AI Agent Chatbot is running",
+    "provider": MODEL_PROVIDER,
+    "model": MODEL_NAME,
+    "timestamp": BUILD_TIME
+})
+HEALTH_BODY = orjson.dumps(HealthResponse.model_construct(
+    status="healthy",
+    provider=MODEL_PROVIDER,
+    model=MODEL_NAME,
+    timestamp=BUILD_TIME
+).model_dump())
+MODELS_BODY = orjson.dumps({"provider": MODEL_PROVIDER, "current_model": MODEL_NAME})
+
 @app.get("/")
-async def root():
+async def root(http_request: Request):
     """Root endpoint"""
-    return {
-        "message": "AI Agent Chatbot is running",
-        "provider": MODEL_PROVIDER,
-        "model": MODEL_NAME,
-        "timestamp": datetime.now().isoformat()
-    }
-
-@app.get("/health", response_model=HealthResponse)
-async def health_check():
+    return etag_response(http_request, ROOT_BODY, max_age=300)
+
+@app.get("/health", responses={200: {"model": HealthResponse}})
+async def health_check(http_request: Request):
     """Health check endpoint"""
-    return HealthResponse(
-        status="healthy",
-        provider=MODEL_PROVIDER,
-        model=MODEL_NAME,
-        timestamp=datetime.now().isoformat()
-    )
+    # Kept short so proxies don't mask an outage for long
+    return etag_response(http_request, HEALTH_BODY, max_age=5)
+
+async def lookup_cached_response(message: str) -> Tuple[Optional[str], Any, Optional[str]]:
+    """Check the exact and semantic caches; return (cache_key, embedding, response)"""
+    cache_key = None
+    response = None
+    if response_cache is not None:
+        cache_key = response_cache.make_key(
+            provider=MODEL_PROVIDER,
+            model=MODEL_NAME,
+            message=message,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS
+        )
+        response = await response_cache.get(cache_key)
+    
+    # Fall back to prompts that are worded differently but mean the same
+    embedding = None
+    if response is None and semantic_cache is not None:
+        embedding = await run_in_threadpool(semantic_cache.embed, message)
+        response = await semantic_cache.lookup(embedding)
+        if response is not None and response_cache is not None:
+            await response_cache.set(cache_key, response)
+    
+    return cache_key, embedding, response
+
+async def store_response(cache_key: Optional[str], embedding: Any, response: str) -> None:
+    """Add a fresh LLM response to the caches"""
+    if response_cache is not None:
+        await response_cache.set(cache_key, response)
+    if semantic_cache is not None:
+        await semantic_cache.add(embedding, response)
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def generate_response(llm: LLMClient, message: str, conversation_id: str,
+                            cache_key: Optional[str], embedding: Any) -> str:
+    """Get a response from the LLM and cache it"""
+    response = await llm.chat(message, conversation_id)
+    
+    logger.info(f"Generated response: {response[:50]}...")
+    
+    await store_response(cache_key, embedding, response)
+    return response
+
+async def stream_chat(llm: LLMClient, message: str, conversation_id: str, cache_key: Optional[str],
+                      embedding: Any, cached: Optional[str]) -> AsyncIterator[str]:
+    """Yield the response as server-sent events, caching it once complete"""
+    if cached is not None:
+        yield f"data: {orjson.dumps({'content': cached}).decode()}\n\n"
+    else:
+        parts = []
+        try:
+            async for text in llm.stream(message, conversation_id):
+                parts.append(text)
+                yield f"data: {orjson.dumps({'content': text}).decode()}\n\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logger.error(f"Chat stream error: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield f"event: error\ndata: {orjson.dumps({'detail': detail}).decode()}\n\n"
+            return
+        await store_response(cache_key, embedding, "".join(parts))
+    yield "data: [DONE]\n\n"
+
+@app.post(
+    "/chat",
+    responses={200: {"model": ChatResponse}, 422: {"model": ValidationErrorResponse}},
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": CHAT_REQUEST_SCHEMA}}}}
+)
+async def chat(http_request: Request):
     """Chat with the AI agent"""
+    try:
+        request = msgspec.json.decode(await http_request.body(), type=ChatRequest)
+    except msgspec.DecodeError as e:
+        # ValidationError subclasses DecodeError; FastAPI's handler renders the 422
+        raise RequestValidationError(validation_errors(e))
+    
     try:
         # Generate conversation ID if not provided
-        conversation_id = request.conversation_id or f"conv_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        conversation_id = request.conversation_id or f"conv_{uuid.uuid4().hex}"
         
         logger.info(f"Processing chat request: {request.message[:50]}...")
         
-        # Get response from LLM
-        response = llm_client.chat(request.message, conversation_id)
+        state = http_request.app.state
+        cache_key, embedding, response = await lookup_cached_response(request.message)
+        
+        # Stream tokens to clients that ask for server-sent events
+        if "text/event-stream" in http_request.headers.get("accept", ""):
+            return StreamingResponse(
+                stream_chat(state.llm, request.message, conversation_id, cache_key, embedding, response),
+                media_type="text/event-stream",
+                headers={"X-Conversation-ID": conversation_id}
+            )
         
-        logger.info(f"Generated response: {response[:50]}...")
+        if response is not None:
+            logger.info("Serving cached response")
+        else:
+            # Concurrent misses for the same prompt share a single LLM call
+            key = cache_key or request.message
+            task = state.inflight.get(key)
+            if task is None:
+                task = asyncio.create_task(
+                    generate_response(state.llm, request.message, conversation_id, cache_key, embedding)
+                )
+                state.inflight[key] = task
+                task.add_done_callback(lambda _: state.inflight.pop(key, None))
+            # Shielded so one client disconnecting doesn't cancel the call for the others
+            response = await asyncio.shield(task)
         
-        return ChatResponse(
+        return ChatResponse.model_construct(
             response=response,
             conversation_id=conversation_id,
             provider=MODEL_PROVIDER,
             model=MODEL_NAME,
-            timestamp=datetime.now().isoformat()
+            timestamp=_iso_now(int(time.time()))
         )
         
+    except HTTPException:
+        # Already carries the provider's status and detail
+        raise
     except Exception as e:
         logger.error(f"Chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/models")
-async def list_models():
+async def list_models(http_request: Request):
     """List available models"""
-    if MODEL_PROVIDER.lower() == "ollama":
-        try:
-            response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            raise HTTPException(status_code=503, detail=f"Cannot connect to Ollama: {e}")
+    global models_cache
     
-    return {"provider": MODEL_PROVIDER, "current_model": MODEL_NAME}
-
-# Startup event
-@app.on_event("startup")
-async def startup_event():
-    """Application startup"""
-    logger.info("🚀 Starting AI Agent Chatbot")
-    logger.info(f"📡 Provider: {MODEL_PROVIDER}")
-    logger.info(f"🤖 Model: {MODEL_NAME}")
-    
-    if MODEL_PROVIDER.lower() == "ollama":
-        logger.info(f"🔗 Ollama URL: {OLLAMA_BASE_URL}")
-        logger.info("💡 Make sure Ollama is running: ollama serve")
+    if PROVIDER is Provider.OLLAMA:
+        if models_cache is None or models_cache[0] <= time.monotonic():
+            try:
+                response = await http_request.app.state.http.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=10)
+                response.raise_for_status()
+            except Exception as e:
+                raise HTTPException(status_code=503, detail=f"Cannot connect to Ollama: {e}")
+            models_cache = (time.monotonic() + MODELS_CACHE_TTL, response.content)
+        
+        # Ollama's bytes are passed through as-is
+        return etag_response(http_request, models_cache[1], max_age=MODELS_CACHE_TTL)
     
-    logger.info("✅ Chatbot is ready!")
+    return etag_response(http_request, MODELS_BODY, max_age=MODELS_CACHE_TTL)
 
 if __name__ == "__main__":
     import uvicorn
     
     port = int(os.getenv("PORT", 8080))
     host = os.getenv("HOST", "0.0.0.0")
+    # A single process by default: each worker holds its own caches (and embedding
+    # model), so size WEB_CONCURRENCY to the container's CPU and memory limits.
+    # Keep blocking work behind run_in_threadpool so each worker's event loop stays free.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    
+    logger.info(f"🌐 Starting server on {host}:{port} with {workers} worker(s)")
     
-    logger.info(f"🌐 Starting server on {host}:{port}")
+    if workers > 1:
+        # Without REDIS_URL each worker keeps its own response cache
+        os.execvp("gunicorn", [
+            "gunicorn",
+            "-k", "uvicorn.workers.UvicornWorker",
+            "-w", str(workers),
+            "-b", f"{host}:{port}",
+            "main:app"
+        ])
     
     uvicorn.run(
         "main:app",
         host=host,
         port=port,
         reload=False,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
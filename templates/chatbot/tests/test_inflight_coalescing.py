@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Tests for coalescing concurrent identical /chat prompts into one LLM call
+
+The OpenAI client talks to a mocked httpx transport that holds every
+completion until the test releases it, so requests can be made to overlap.
+"""
+
+import asyncio
+import importlib.util
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+
+# main.py is not an importable package module, so load it by path
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+_spec = importlib.util.spec_from_file_location(
+    "chatbot_template_main", Path(__file__).resolve().parents[1] / "main.py"
+)
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+PROMPT = {"message": "What are your opening hours?"}
+
+class UpstreamStub:
+    """Mocked OpenAI endpoint that counts calls and answers once released"""
+
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        self.started.set()
+        await self.release.wait()
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, json={"error": {"message": "upstream failure"}})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "We open at 9am."}}]})
+
+@pytest.fixture(autouse=True)
+def no_response_caches(monkeypatch):
+    """Disable the caches so every request reaches the coalescer"""
+    monkeypatch.setattr(main, "response_cache", None)
+    monkeypatch.setattr(main, "semantic_cache", None)
+
+async def run_with_upstream(upstream: UpstreamStub, scenario):
+    """Run ``scenario(client)`` against the app with the LLM behind ``upstream``"""
+    async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as http:
+        main.app.state.llm = main.OpenAIClient("test-key", "gpt-4", http)
+        main.app.state.inflight = {}
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app), base_url="http://testserver"
+        ) as client:
+            return await scenario(client)
+
+async def wait_for_waiters(upstream: UpstreamStub):
+    """Let the upstream call start and the other requests reach the shared task"""
+    await upstream.started.wait()
+    await asyncio.sleep(0.05)
+
+class TestInflightCoalescing:
+    """Test single-flight handling of concurrent cache misses"""
+
+    def test_identical_prompts_share_one_upstream_call(self):
+        upstream = UpstreamStub()
+
+        async def scenario(client):
+            requests = [asyncio.create_task(client.post("/chat", json=PROMPT)) for _ in range(5)]
+            await wait_for_waiters(upstream)
+            upstream.release.set()
+            return await asyncio.gather(*requests)
+
+        responses = asyncio.run(run_with_upstream(upstream, scenario))
+
+        assert upstream.calls == 1
+        assert [response.status_code for response in responses] == [200] * 5
+        assert {response.json()["response"] for response in responses} == {"We open at 9am."}
+        assert main.app.state.inflight == {}
+
+    def test_different_prompts_are_not_coalesced(self):
+        upstream = UpstreamStub()
+
+        async def scenario(client):
+            requests = [
+                asyncio.create_task(client.post("/chat", json={"message": f"Question {i}"}))
+                for i in range(3)
+            ]
+            await wait_for_waiters(upstream)
+            upstream.release.set()
+            return await asyncio.gather(*requests)
+
+        responses = asyncio.run(run_with_upstream(upstream, scenario))
+
+        assert upstream.calls == 3
+        assert [response.status_code for response in responses] == [200] * 3
+
+    def test_upstream_failure_reaches_every_waiter(self):
+        upstream = UpstreamStub(status_code=500)
+
+        async def scenario(client):
+            requests = [asyncio.create_task(client.post("/chat", json=PROMPT)) for _ in range(4)]
+            await wait_for_waiters(upstream)
+            upstream.release.set()
+            return await asyncio.gather(*requests)
+
+        responses = asyncio.run(run_with_upstream(upstream, scenario))
+
+        assert upstream.calls == 1
+        assert [response.status_code for response in responses] == [500] * 4
+        assert all("OpenAI API error" in response.json()["detail"] for response in responses)
+        assert main.app.state.inflight == {}
+
+    def test_cancelled_waiter_does_not_cancel_shared_call(self):
+        upstream = UpstreamStub()
+
+        async def scenario(client):
+            first = asyncio.create_task(client.post("/chat", json=PROMPT))
+            second = asyncio.create_task(client.post("/chat", json=PROMPT))
+            await wait_for_waiters(upstream)
+
+            # The first request started the shared call; dropping it must not stop it
+            first.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+
+            upstream.release.set()
+            return await second
+
+        response = asyncio.run(run_with_upstream(upstream, scenario))
+
+        assert upstream.calls == 1
+        assert response.status_code == 200
+        assert response.json()["response"] == "We open at 9am."
+        assert main.app.state.inflight == {}